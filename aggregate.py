@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import getopt
+import os, sys
+import warnings
+import numpy as np
+from collections import OrderedDict
+from utils import import_params, get_weights_compact, read_chunks, log_exists, is_archive, ARCHIVE_EXT, weight_steps, weight_convergence, map_batch, PROFILE_OPTS, profile_option, stage
+from params_index import open_index, indexed, update_index, query_index
+from force_fields import movements, ideal_force_field, compute_force_fields
+
+def usage():
+    print("""usage: {} [OPTION...] DIRECTORY...
+
+Summarize many experiments into a single table with one row per experiment
+(or per parameter group) containing the parameters and these metrics:
+
+  T                     number of time steps
+  convergence_x/_y      first time step after which the norm of the weight
+                        change per time step stays below EPS (nan if not
+                        converged)
+  ideal_diff_x/_y       summed absolute difference of the final force field
+                        to the ideal one (see ideal_force_field.m)
+  ideal_dir_x/_y        number of inputs whose final force field points in
+                        the same direction as the ideal one
+  reward_N              final cumulative reward of reward channel N
+
+With -g, the metrics are averaged over the experiments of a group and the
+columns converged_x/_y give the number of converged experiments, over which
+convergence_x/_y are averaged.
+
+options:
+
+  -R          recursive mode, summarize all experiment directories and
+              archives (see pack.py) below DIRECTORY
+  -I FILE     use the experiment index in FILE (see show-params.py) to find
+              experiment directories in recursive mode, the tree is only
+              scanned if it isn't indexed yet
+  -U          update the index given by -I before using it
+  -g PARAM... comma-separated list (without space) of parameters to group
+              by, metrics are averaged over all experiments of a group
+  -e EPS      weight change threshold for convergence (default: 1e-3)
+  -o FILE     write table to FILE instead of standard output, as a numpy
+              archive with one array per column if FILE ends in .npz and as
+              CSV otherwise
+  -j JOBS     process JOBS directories in parallel
+  --profile   print time and peak memory of each processing stage on exit
+  --profile-json=FILE
+              write time and peak memory of each processing stage as JSON
+              to FILE
+  --profile-dump=FILE
+              write cProfile statistics of the slowest stage to FILE
+  -h          show this help and exit
+""".format(os.path.basename(sys.argv[0])))
+
+def summarize(ddir, eps):
+    params = import_params(ddir, verbose=False)
+    if not params:
+        raise ValueError("no parameters found")
+
+    nRows = int(params['nRowsIn'])
+    nCols = int(params['nColsIn'])
+    nOutputs = int(params['nOutputs'])
+    popMinX = float(params['popMinX'])
+    popMaxX = float(params['popMaxX'])
+    popMinY = float(params['popMinY'])
+    popMaxY = float(params['popMaxY'])
+    nInputs = nRows * nCols
+
+    metrics = OrderedDict()
+
+    # the weight logs are streamed for the convergence, only the final
+    # weights are read at once, without writing a weight cache
+    with stage('compute'):
+        metrics['T'] = weight_steps(ddir)
+        # experiments which didn't converge are left out of group averages
+        for axis in ('x', 'y'):
+            step = weight_convergence(ddir, axis, eps)
+            metrics['convergence_' + axis] = step if step >= 0 else np.nan
+
+    with stage('parse'):
+        W = get_weights_compact(ddir, nInputs, nOutputs, np.float32, verbose=False, cache=False, ts=[-1])
+    if W is None:
+        raise ValueError("failed to read weights")
+    time, Wx, Wy = W
+
+    with stage('compute'):
+        dx, dy = compute_force_fields(Wx, Wy, [-1], movements(popMinX, popMaxX, nOutputs),
+                                      movements(popMinY, popMaxY, nOutputs), nRows, nCols)
+        u, v = ideal_force_field(popMinX, popMaxX, popMinY, popMaxY, nRows, nCols)
+        metrics['ideal_diff_x'] = np.abs(dx[0] - u).sum()
+        metrics['ideal_diff_y'] = np.abs(dy[0] - v).sum()
+        metrics['ideal_dir_x'] = (np.sign(dx[0]) == np.sign(u)).sum()
+        metrics['ideal_dir_y'] = (np.sign(dy[0]) == np.sign(v)).sum()
+
+    # only the running sum of the reward log is kept in memory
+    fname = os.path.join(ddir, 'reward.log')
+    if log_exists(fname):
+        total = None
+        with stage('parse'):
+            for chunk in read_chunks(fname):
+                s = chunk[:,1:].sum(axis=0)
+                total = s if total is None else total + s
+        for n, r in enumerate(total if total is not None else []):
+            metrics['reward_{}'.format(n)] = r
+
+    return params, metrics
+
+def find_experiments(roots, index=None, update=False):
+    dirs = []
+    for root in roots:
+        if index is not None:
+            db = open_index(index)
+            if update or not indexed(db, root):
+                update_index(db, root)
+            dirs.extend(query_index(db, root))
+            db.close()
+        else:
+            for d, _, files in os.walk(root):
+                if 'params.log' in files:
+                    dirs.append(d)
+                dirs.extend(os.path.join(d, f) for f in files
+                            if f.endswith(ARCHIVE_EXT) and is_archive(os.path.join(d, f)))
+
+    return dirs
+
+# metrics which are counts or time steps
+INTEGER_METRICS = [ 'T', 'convergence_x', 'convergence_y', 'ideal_dir_x', 'ideal_dir_y', 'converged_x', 'converged_y' ]
+
+def make_table(results, group):
+    # collect all parameter and metric names in the order they appear
+    pnames = OrderedDict()
+    mnames = OrderedDict()
+    for ddir, params, metrics in results:
+        pnames.update((l, None) for l in params if l != 'time')
+        mnames.update((m, None) for m in metrics)
+
+    rows = []
+    for ddir, params, metrics in sorted(results, key=lambda r: r[0]):
+        rows.append(([ ddir ] + [ params.get(l, '') for l in pnames ],
+                     [ metrics.get(m, np.nan) for m in mnames ]))
+
+    if group is None:
+        columns = [ 'directory' ] + list(pnames)
+    else:
+        # average the metrics over all experiments with the same values of
+        # the grouping parameters
+        groups = OrderedDict()
+        for labels, values in rows:
+            key = tuple(labels[1 + list(pnames).index(l)] if l in pnames else '' for l in group)
+            groups.setdefault(key, []).append(values)
+
+        converged = [ m for m in ('convergence_x', 'convergence_y') if m in mnames ]
+        rows = []
+        for key, values in sorted(groups.items()):
+            values = np.array(values, dtype=np.float64)
+            with warnings.catch_warnings():
+                # groups in which no experiment converged average to nan
+                warnings.simplefilter('ignore', RuntimeWarning)
+                means = list(np.nanmean(values, axis=0))
+            counts = [ np.sum(~np.isnan(values[:,list(mnames).index(m)])) for m in converged ]
+            rows.append((list(key) + [ str(len(values)) ], means + counts))
+        columns = list(group) + [ 'runs' ]
+        mnames.update(('converged_' + m[-1], None) for m in converged)
+
+    table = OrderedDict()
+    for i, c in enumerate(columns):
+        table[c] = np.array([ labels[i] for labels, _ in rows ], dtype=str)
+    for i, m in enumerate(mnames):
+        table[m] = np.array([ values[i] for _, values in rows ], dtype=np.float64)
+        if m in INTEGER_METRICS and np.all(table[m] == np.round(table[m])):
+            table[m] = table[m].astype(np.int64)
+
+    return table
+
+def format_value(v, integer):
+    # whole numbers of integer metrics are written without decimals, even if
+    # the column is float because of missing values
+    if integer and not np.isnan(v) and v == np.round(v):
+        return str(int(v))
+    return str(v)
+
+def write_table(table, fname=None):
+    if fname is not None and fname.endswith('.npz'):
+        np.savez(fname, **table)
+        return
+
+    f = sys.stdout if fname is None else open(fname, 'w')
+    f.write(','.join(table.keys()) + '\n')
+    n = len(list(table.values())[0]) if len(table) > 0 else 0
+    for i in range(n):
+        f.write(','.join(format_value(table[c][i], c in INTEGER_METRICS) for c in table) + '\n')
+    if f is not sys.stdout:
+        f.close()
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "RI:Ug:e:o:j:h", PROFILE_OPTS)
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+        sys.exit(-1)
+
+    if len(args) < 1:
+        usage()
+        sys.exit(-1)
+
+    recursive = False
+    index = None
+    update = False
+    group = None
+    eps = 1e-3
+    out = None
+    jobs = 1
+
+    for o, a in opts:
+        if o == '-R':
+            recursive = True
+        elif o == '-I':
+            index = a
+        elif o == '-U':
+            update = True
+        elif o == '-g':
+            group = a.split(',')
+        elif o == '-e':
+            eps = float(a)
+        elif o == '-o':
+            out = a
+        elif o == '-j':
+            jobs = int(a)
+        elif o == '-h':
+            usage()
+            sys.exit(0)
+        elif o.startswith('--profile'):
+            profile_option(o, a)
+        else:
+            assert False, "unhandled option"
+
+    dirs = find_experiments(args, index, update) if recursive else args
+
+    results = []
+    failed = 0
+    for ddir, r, err in map_batch(summarize, dirs, (eps,), jobs=jobs):
+        if err is not None:
+            failed += 1
+            sys.stderr.write("{}: failed: {}\n".format(ddir, err))
+            continue
+        results.append((ddir, r[0], r[1]))
+
+    if failed > 0:
+        sys.stderr.write("{} of {} directories failed\n".format(failed, len(dirs)))
+
+    with stage('save'):
+        write_table(make_table(results, group), out)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# bench.py -- Time the stages of the plotting scripts on synthetic experiments
+
+import getopt
+import os, sys
+import json
+import platform
+import shutil
+import tempfile
+import datetime
+import numpy as np
+from collections import OrderedDict
+from utils import get_cmap, use_headless, enable_profile, profile_breakdown, profile_reset, LINE_INDEX, WEIGHTS_CACHE
+from gen_experiment import gen_experiment
+from force_fields import force_fields
+from heatmap import heatmap
+from reward import reward
+from plot_weights import weights
+from gen_weights_all import gen_weights_all
+
+def usage():
+    print("""usage: {} [OPTION...]
+
+Generate synthetic experiments of several sizes and time the parse, compute,
+render and save stages of the plotting scripts on them. The scripts are run
+with their default options in quiet mode, the stages are the ones they
+report with --profile.
+
+options:
+
+  -s SCALE... comma-separated list (without space) of experiment sizes given
+              as ROWSxCOLSxOUTPUTSxSTEPS (default: 5x5x5x1000,5x5x5x10000,
+              10x10x10x10000)
+  -b SCRIPT... comma-separated list (without space) of scripts to benchmark
+              (default: force_fields,heatmap,reward,plot_weights,
+              gen_weights_all)
+  -n REPEAT   number of repetitions per measurement, the best is reported
+              (default: 3)
+  -W          keep weight caches and line indexes between repetitions
+              instead of removing them before each run
+  -d DIR      generate the experiments below DIR and keep them, existing
+              experiments of the same size are reused
+  -o FILE     write the results as JSON to FILE
+  -h          show this help and exit
+""".format(os.path.basename(sys.argv[0])))
+
+STAGES = [ 'parse', 'compute', 'render', 'save' ]
+
+# the scripts' main functions called with their default options
+def bench_force_fields(ddir):
+    force_fields(ddir, np.array([0, -1]), False, False, 10, None, True, False, get_cmap(None, default='Blues'))
+
+def bench_heatmap(ddir):
+    heatmap(ddir, np.array([-1]), None, True, False, get_cmap(None))
+
+def bench_reward(ddir):
+    reward(ddir, np.array([], np.int32), False, True, False)
+
+def bench_plot_weights(ddir):
+    weights(ddir, np.array([-1]), True, False, get_cmap(None))
+
+def bench_gen_weights_all(ddir):
+    gen_weights_all(ddir)
+
+BENCHMARKS = OrderedDict([
+    ('force_fields', bench_force_fields),
+    ('heatmap', bench_heatmap),
+    ('reward', bench_reward),
+    ('plot_weights', bench_plot_weights),
+    ('gen_weights_all', bench_gen_weights_all),
+])
+
+def parse_scale(s):
+    try:
+        nRows, nCols, nOutputs, T = [ int(v) for v in s.split('x') ]
+    except ValueError:
+        raise ValueError("invalid scale specification: {}".format(s))
+    return nRows, nCols, nOutputs, T
+
+def experiment_dir(root, scale):
+    # reuse an experiment generated earlier with the same size
+    ddir = os.path.join(root, 'x'.join(str(v) for v in scale))
+    if not os.path.isfile(os.path.join(ddir, 'params.log')):
+        nRows, nCols, nOutputs, T = scale
+        gen_experiment(ddir, nRows, nCols, nOutputs, T, seed=0)
+    return ddir
+
+def clean(ddir):
+    # remove what earlier runs left behind to be read by the next one
+    for f in os.listdir(ddir):
+        if f.endswith(LINE_INDEX) or f.startswith(WEIGHTS_CACHE):
+            os.remove(os.path.join(ddir, f))
+
+def run_once(name, ddir):
+    # the scripts' output is not of interest here
+    import matplotlib.pyplot as plt
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    profile_reset()
+    try:
+        BENCHMARKS[name](ddir)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        plt.close('all')
+
+    return OrderedDict((stage, s['time']) for stage, s in profile_breakdown().items())
+
+def run(scales, scripts, repeat, root, warm):
+    results = []
+    for scale in scales:
+        ddir = experiment_dir(root, scale)
+        for name in scripts:
+            # keep the best time of each stage over all repetitions
+            best = OrderedDict()
+            for _ in range(repeat):
+                if not warm:
+                    clean(ddir)
+                for stage, t in run_once(name, ddir).items():
+                    best[stage] = min(best.get(stage, t), t)
+
+            nRows, nCols, nOutputs, T = scale
+            results.append(OrderedDict([
+                ('script', name),
+                ('nRows', nRows),
+                ('nCols', nCols),
+                ('nOutputs', nOutputs),
+                ('T', T),
+                ('stages', best),
+                ('total', sum(best.values())),
+            ]))
+            print_result(results[-1])
+
+    return results
+
+def print_header():
+    print("{:<16} {:>16} ".format('script', 'size') +
+          ' '.join("{:>9}".format(s) for s in STAGES + [ 'total' ]))
+
+def print_result(r):
+    size = "{}x{}x{}x{}".format(r['nRows'], r['nCols'], r['nOutputs'], r['T'])
+    stages = [ "{:>9.4f}".format(r['stages'][s]) if s in r['stages'] else "{:>9}".format('-') for s in STAGES ]
+    print("{:<16} {:>16} ".format(r['script'], size) + ' '.join(stages) + " {:>9.4f}".format(r['total']))
+    sys.stdout.flush()
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "s:b:n:Wd:o:h")
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+        sys.exit(-1)
+
+    scales = [ (5, 5, 5, 1000), (5, 5, 5, 10000), (10, 10, 10, 10000) ]
+    scripts = list(BENCHMARKS)
+    repeat = 3
+    warm = False
+    root = None
+    out = None
+
+    for o, a in opts:
+        if o == '-s':
+            try:
+                scales = [ parse_scale(s) for s in a.split(',') ]
+            except ValueError as err:
+                print(str(err))
+                sys.exit(-1)
+        elif o == '-b':
+            scripts = a.split(',')
+            for s in scripts:
+                if s not in BENCHMARKS:
+                    print("unknown script: {}".format(s))
+                    sys.exit(-1)
+        elif o == '-n':
+            repeat = int(a)
+        elif o == '-W':
+            warm = True
+        elif o == '-d':
+            root = a
+        elif o == '-o':
+            out = a
+        elif o == '-h':
+            usage()
+            sys.exit(0)
+        else:
+            assert False, "unhandled option"
+
+    use_headless()
+    enable_profile()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print_header()
+        results = run(scales, scripts, repeat, root if root is not None else tmpdir, warm)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if out is not None:
+        import matplotlib
+        report = OrderedDict([
+            ('date', datetime.datetime.now().isoformat()),
+            ('host', platform.node()),
+            ('python', platform.python_version()),
+            ('numpy', np.__version__),
+            ('matplotlib', matplotlib.__version__),
+            ('repeat', repeat),
+            ('warm', warm),
+            ('results', results),
+        ])
+        f = open(out, 'w')
+        json.dump(report, f, indent=2)
+        f.write('\n')
+        f.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# bench_csv.py -- Compare utils.load_csv against np.genfromtxt on synthetic logs
+
+import getopt
+import os, sys
+import shutil
+import tempfile
+import timeit
+import numpy as np
+from utils import load_csv
+
+def usage():
+    print("""usage: {} [OPTION...]
+
+Benchmark utils.load_csv against np.genfromtxt on synthetic drobot logs.
+
+options:
+
+  -r ROWS...  comma-separated list (without space) of row counts
+              (default: 10000,100000,1000000)
+  -c COLS     number of value columns besides time (default: 6)
+  -n REPEAT   number of repetitions per measurement, the best is reported
+              (default: 3)
+  -h          show this help and exit
+""".format(os.path.basename(sys.argv[0])))
+
+def write_log(fname, T, nCols):
+    # time column followed by weight-like values, as in weights_x_in_N.log
+    data = np.hstack((np.arange(T).reshape(-1, 1), np.random.rand(T, nCols)))
+    np.savetxt(fname, data, fmt='%1.12f', delimiter=',')
+
+def bench(fname, repeat):
+    loaders = [
+        ('genfromtxt', lambda: np.genfromtxt(fname, delimiter=',')),
+        ('load_csv', lambda: load_csv(fname)),
+        ('load_csv float32', lambda: load_csv(fname, dtype=np.float32)),
+    ]
+
+    return [ (name, min(timeit.repeat(fn, number=1, repeat=repeat))) for name, fn in loaders ]
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "r:c:n:h")
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+        sys.exit(-1)
+
+    rows = [10000, 100000, 1000000]
+    nCols = 6
+    repeat = 3
+
+    for o, a in opts:
+        if o == '-r':
+            rows = [ int(r) for r in a.split(',') ]
+        elif o == '-c':
+            nCols = int(a)
+        elif o == '-n':
+            repeat = int(a)
+        elif o == '-h':
+            usage()
+            sys.exit(0)
+        else:
+            assert False, "unhandled option"
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print("{:>10}  {:<18} {:>10} {:>8}".format('rows', 'loader', 'time [s]', 'speedup'))
+        for T in rows:
+            fname = os.path.join(tmpdir, 'weights_x_in_0.log')
+            write_log(fname, T, nCols)
+            results = bench(fname, repeat)
+            ref = results[0][1]
+            for name, t in results:
+                print("{:>10}  {:<18} {:>10.4f} {:>7.1f}x".format(T, name, t, ref / t))
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# bench_startup.py -- Measure the startup time of the command line scripts
+
+import getopt
+import os, sys
+import subprocess
+import timeit
+
+def usage():
+    print("""usage: {} [OPTION...]
+
+Measure the startup time of the scripts by running them with -h, which
+exits right after all modules are imported, and compare it to the time
+needed to import matplotlib.pyplot alone.
+
+options:
+
+  -s SCRIPT... comma-separated list (without space) of scripts to run
+              (default: all scripts in the same directory as this one)
+  -n REPEAT   number of runs per script, the best is reported (default: 5)
+  -h          show this help and exit
+""".format(os.path.basename(sys.argv[0])))
+
+SCRIPTS = [
+    'show-params.py',
+    'gen_weights_all.py',
+    'aggregate.py',
+    'force_fields.py',
+    'heatmap.py',
+    'reward.py',
+    'plot_weights.py',
+    'plot_output.py',
+]
+
+def run(cmd, repeat):
+    devnull = open(os.devnull, 'w')
+    def once():
+        subprocess.call(cmd, stdout=devnull, stderr=devnull)
+    t = min(timeit.repeat(once, number=1, repeat=repeat))
+    devnull.close()
+    return t
+
+def imports_pyplot(script):
+    # run the script's module level code and check what it imported
+    code = ("import os, sys, runpy; sys.argv = [{0!r}, '-h']\n"
+            "sys.path.insert(0, os.path.dirname({0!r}))\n"
+            "try:\n"
+            "    runpy.run_path({0!r}, run_name='__main__')\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            "sys.stderr.write(str('matplotlib.pyplot' in sys.modules))\n").format(script)
+    p = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, err = p.communicate()
+    return err.decode().strip().endswith('True')
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "s:n:h")
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+        sys.exit(-1)
+
+    scripts = SCRIPTS
+    repeat = 5
+
+    for o, a in opts:
+        if o == '-s':
+            scripts = a.split(',')
+        elif o == '-n':
+            repeat = int(a)
+        elif o == '-h':
+            usage()
+            sys.exit(0)
+        else:
+            assert False, "unhandled option"
+
+    sdir = os.path.dirname(os.path.abspath(__file__))
+
+    base = run([sys.executable, '-c', 'pass'], repeat)
+    numpy = run([sys.executable, '-c', 'import numpy'], repeat)
+    pyplot = run([sys.executable, '-c', 'import matplotlib.pyplot'], repeat)
+
+    print("{:<24} {:>10} {:>8}".format('command', 'time [s]', 'pyplot'))
+    print("{:<24} {:>10.3f} {:>8}".format('python', base, '-'))
+    print("{:<24} {:>10.3f} {:>8}".format('import numpy', numpy, '-'))
+    print("{:<24} {:>10.3f} {:>8}".format('import matplotlib.pyplot', pyplot, 'yes'))
+    for s in scripts:
+        path = os.path.join(sdir, s)
+        t = run([sys.executable, path, '-h'], repeat)
+        print("{:<24} {:>10.3f} {:>8}".format(s + ' -h', t, 'yes' if imports_pyplot(path) else 'no'))
+
+if __name__ == '__main__':
+    main()
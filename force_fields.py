@@ -6,8 +6,10 @@ import os, sys
 import fnmatch
 import re
 import numpy as np
-import matplotlib.pyplot as plt
-from utils import import_params, get_weights, get_cmap
+from utils import import_params, get_weights_compact, weight_steps, get_cmap, fit_time_steps, run_batch, tail_log, refresh, write_frames, movie_files, movie_error, use_headless, output_path, PROFILE_OPTS, profile_option, stage
+
+# number of frames to compute at once in movie mode
+FRAME_BLOCK = 1024
 
 def usage():
     print("""usage: {} [OPTION...] DIRECTORY...
@@ -19,20 +21,162 @@ By default the plot is shown for the first and last time step.
 options:
 
   -c          enable continuous mode (time and subplot options are ignored)
+  -m FILE     movie mode, write the force field for every STEP time steps to
+              FILE in the experiment directory (using ffmpeg) or, if FILE
+              ends in .png, to a sequence of numbered PNG files
+  -F FPS      frames per second in movie mode
   -C CMAP     use CMAP as colormap in continuous mode, see help(colormaps) in
               matplotlib for a list
   -t TIME...  comma-separated list (without space) of timestamps, negative
               numbers are intepreted as counting from the end (as in python)
   -s SUBPLOT  specify subplot layout (e.g. 23 for 2 rows and 3 columns)
-  -S STEP     specify time step to use in continous mode
+  -S STEP     specify time step to use in continous and movie mode
   -T          show experiment path in figure title
+  -f SECS     follow mode, keep reading data appended to the weight files
+              and refresh the plot of the most recent time step every SECS
+              seconds (time and subplot options are ignored, with -q the PDF
+              is rewritten instead)
+  -p PROCS    parse weight files using PROCS processes
+  -j JOBS     process JOBS directories in parallel (implies -q)
   -q          quiet mode, don't show plot, only write PDF
   -w          use winner-take-all instead of weighted sum to calculate
               resulting output
+  --profile   print time and peak memory of each processing stage on exit
+  --profile-json=FILE
+              write time and peak memory of each processing stage as JSON
+              to FILE
+  --profile-dump=FILE
+              write cProfile statistics of the slowest stage to FILE
   -h          show this help and exit
 """.format(os.path.basename(sys.argv[0])))
 
-def force_fields(ddir, ts, wta, continuous, csteps, subplot, quiet, show_title, cmap):
+def movements(popMin, popMax, nOutputs):
+    # movement coded by each of the output neurons
+    interval = (popMax - popMin) / (nOutputs - 1)
+    return np.arange(popMin, popMax + 1, interval)
+
+def ideal_force_field(minX, maxX, minY, maxY, nRows, nCols):
+    # "ideal" force field to result in fixating behavior, as in
+    # ideal_force_field.m
+    x = np.linspace(minX, maxX, nCols) * (-1)
+    y = np.linspace(minY, maxY, nRows)
+    u, v = np.meshgrid(x, y)
+    return np.flipud(u), np.flipud(v)
+
+def compute_force_fields(Wx, Wy, ts, oMovementX, oMovementY, nRows, nCols, wta=False):
+    # weights (without time, see get_weights_compact) at the requested time
+    # steps, the resulting arrays are of shape (len(ts), nOutputs, nInputs)
+    wxt = np.asarray(Wx[ts])
+    wyt = np.asarray(Wy[ts])
+
+    if not wta:
+        dx = np.einsum('ton,o->tn', wxt, oMovementX) / wxt.sum(axis=1)
+        dy = np.einsum('ton,o->tn', wyt, oMovementY) / wyt.sum(axis=1)
+    else:
+        dx = oMovementX[np.argmax(wxt, axis=1)]
+        dy = oMovementY[np.argmax(wyt, axis=1)]
+
+    # convert to matrices
+    dx = dx.reshape(len(ts), nRows, nCols)
+    dy = dy.reshape(len(ts), nRows, nCols)
+    # flip up to down since 0,0 is the input neuron for the upper left
+    # corner. Invert x since positive value means movement to the left.
+    dx = dx[:,::-1,:] * (-1.0)
+    dy = dy[:,::-1,:]
+
+    return dx, dy
+
+def format_axes(ax, nRows, nCols):
+    ax.axis([0.5, nCols + 0.5, 0.5, nRows + 0.5])
+    ax.set_xticks(np.arange(1, nCols + 1, 2))
+    ax.set_xticklabels(np.arange(0, nCols, 2), fontsize=8)
+    ax.set_yticks(np.arange(1, nRows + 1, 2))
+    ax.set_yticklabels(np.arange(0, nRows, 2), fontsize=8)
+    ax.set_aspect('equal', 'box')
+
+def force_fields_movie(fname, x, y, Wx, Wy, oMovementX, oMovementY, nRows, nCols, wta, csteps, fps, title=None):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    T = Wx.shape[0]
+    ts = np.arange(0, T, csteps)
+
+    # render off-screen into a single figure, only the quiver data and the
+    # title get updated for each frame
+    fig = Figure(figsize=(6, 6), dpi=100)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    format_axes(ax, nRows, nCols)
+    if title is not None:
+        fig.suptitle(title)
+
+    frames = write_frames(fig, fname, fps)
+    next(frames)
+
+    Q = None
+    try:
+        # compute the force fields in blocks of frames to bound memory
+        for b in range(0, len(ts), FRAME_BLOCK):
+            DX, DY = compute_force_fields(Wx, Wy, ts[b:b + FRAME_BLOCK], oMovementX, oMovementY, nRows, nCols, wta)
+            for i, t in enumerate(ts[b:b + FRAME_BLOCK]):
+                if Q is None:
+                    Q = ax.quiver(x, y, DX[i], DY[i], units='width', width=0.0035, color='b', edgecolors=('b'))
+                    text = ax.set_title("time step {}".format(t), fontsize=12)
+                else:
+                    Q.set_UVC(DX[i], DY[i])
+                    text.set_text("time step {}".format(t))
+
+                next(frames)
+    finally:
+        frames.close()
+
+    return len(ts)
+
+def force_fields_follow(ddir, x, y, oMovementX, oMovementY, nRows, nCols, nOutputs, wta, interval, quiet, show_title):
+    import matplotlib.pyplot as plt
+
+    nInputs = nRows * nCols
+    logs = {}
+    W = {}
+    steps = {}
+    for axis in ('x', 'y'):
+        logs[axis] = [ tail_log(os.path.join(ddir, 'weights_{}_in_{}.log'.format(axis, n))) for n in range(nInputs) ]
+        W[axis] = np.zeros((1, nOutputs, nInputs))
+        steps[axis] = np.zeros(nInputs, dtype=np.int64)
+
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    format_axes(ax, nRows, nCols)
+    if show_title:
+        fig.suptitle(ddir)
+
+    Q = None
+    pdf = output_path(ddir, 'force_field.pdf') if quiet else None
+    for _ in refresh(fig, interval, pdf):
+        # only the newly appended lines are parsed, of which only the most
+        # recent weights are kept
+        changed = False
+        for axis in ('x', 'y'):
+            for n, log in enumerate(logs[axis]):
+                rows = next(log)
+                if len(rows) > 0:
+                    W[axis][0,:,n] = rows[-1,1:]
+                    steps[axis][n] += len(rows)
+                    changed = True
+
+        # wait until there are weights for all inputs
+        T = min(steps['x'].min(), steps['y'].min())
+        if not changed or T == 0:
+            continue
+
+        dx, dy = compute_force_fields(W['x'], W['y'], [0], oMovementX, oMovementY, nRows, nCols, wta)
+        if Q is None:
+            Q = ax.quiver(x, y, dx[0], dy[0], units='width', width=0.0035, color='b', edgecolors=('b'))
+        else:
+            Q.set_UVC(dx[0], dy[0])
+        ax.set_title("time step {}".format(T - 1), fontsize=12)
+
+def force_fields(ddir, ts, wta, continuous, csteps, subplot, quiet, show_title, cmap, workers=1, movie=None, fps=4, follow=None):
     params = import_params(ddir)
 
     try:
@@ -49,101 +193,86 @@ def force_fields(ddir, ts, wta, continuous, csteps, subplot, quiet, show_title,
 
     nInputs = nRows * nCols
 
-    Wx, Wy = get_weights(ddir, nInputs, nOutputs)
-    if Wx is None or Wy is None:
-        print("failed to read weights")
-        return
-
-    intervalX = (popMaxX - popMinX) / (nOutputs - 1)
-    intervalY = (popMaxY - popMinY) / (nOutputs - 1)
-    oMovementX = np.arange(popMinX, popMaxX + 1, intervalX)
-    oMovementY = np.arange(popMinY, popMaxY + 1, intervalY)
+    oMovementX = movements(popMinX, popMaxX, nOutputs)
+    oMovementY = movements(popMinY, popMaxY, nOutputs)
 
-    time = Wx[:,0,0]
-    T = len(time)
     [x, y] = np.meshgrid(np.arange(1, nRows + 1), np.arange(1, nCols + 1))
 
-    if continuous:
-        ts = range(0, T + 1, csteps)
-
-    fig = plt.figure()
+    if follow is not None:
+        force_fields_follow(ddir, x, y, oMovementX, oMovementY, nRows, nCols, nOutputs, wta, follow, quiet, show_title)
+        return
 
-    for i, t in enumerate(ts):
-        # use negative indices as in python
-        if t < 0:
-            t = T + t
+    # only the requested time steps are read unless all of them are needed
+    selected = movie is None and not continuous
+    with stage('parse'):
+        W = get_weights_compact(ddir, nInputs, nOutputs, np.float32, workers=workers,
+                                ts=ts if selected else None)
+    if W is None:
+        print("failed to read weights")
+        return
+    time, Wx, Wy = W
+    T = weight_steps(ddir) if selected else len(time)
+
+    if movie is not None:
+        fname = output_path(ddir, movie)
+        with stage('movie'):
+            n = force_fields_movie(fname, x, y, Wx, Wy, oMovementX, oMovementY, nRows, nCols, wta, csteps, fps,
+                                   title=ddir if show_title else None)
+        print("{} frames written to {}".format(n, movie_files(fname)))
+        return
 
-        if t >= T:
-            t = T - 1
-        elif t < 0:
-            t = 0
+    if continuous:
+        ts = range(0, T + 1, csteps)
 
-        dx = np.zeros([nInputs, 1])
-        dy = np.zeros([nInputs, 1])
+    ts = fit_time_steps(ts, T)
+    with stage('compute'):
+        DX, DY = compute_force_fields(Wx, Wy, np.arange(len(ts)) if selected else ts,
+                                      oMovementX, oMovementY, nRows, nCols, wta)
 
-        for n in range(nInputs):
-            wxt = Wx[t,1:,n]
-            wyt = Wy[t,1:,n]
+    with stage('render'):
+        import matplotlib.pyplot as plt
+        fig = plt.figure()
 
-            if not wta:
-                oTotalX = wxt.sum()
-                oTotalY = wyt.sum()
+        for i, t in enumerate(ts):
+            dx, dy = DX[i], DY[i]
 
-                dx[n] = np.dot(wxt, oMovementX) / oTotalX
-                dy[n] = np.dot(wyt, oMovementY) / oTotalY
+            if not continuous:
+                if subplot is None:
+                    s = '1' + str(len(ts)) + str(i + 1)
+                else:
+                    s = subplot + str(i + 1)
             else:
-                amx = np.argmax(wxt)
-                amy = np.argmax(wyt)
-
-                dx[n] = oMovementX[amx]
-                dy[n] = oMovementY[amy]
-
-        # convert to matrix
-        dx = dx.reshape(nRows, nCols)
-        dy = dy.reshape(nRows, nCols)
-        # flip up to down since 0,0 is the input neuron for the upper left
-        # corner. Invert x since positive value means movement to the left.
-        dx = np.flipud(dx) * (-1.0)
-        dy = np.flipud(dy)
-
-        if not continuous:
-            if subplot is None:
-                s = '1' + str(len(ts)) + str(i + 1)
-            else:
-                s = subplot + str(i + 1)
-        else:
-            s = '111'
+                s = '111'
 
-        ax = fig.add_subplot(int(s))
+            ax = fig.add_subplot(int(s))
 
-        c = np.ones((nRows,nCols)) * i
+            c = np.ones((nRows,nCols)) * i
 
-        if not continuous:
-            Q = ax.quiver(x, y, dx, dy, units='width', width=0.0035, color='b', edgecolors=('b'))
-        else:
-            Q = ax.quiver(x, y, dx, dy, units='width', width=0.0035, color=cmap(float(csteps * i) / T))
+            if not continuous:
+                Q = ax.quiver(x, y, dx, dy, units='width', width=0.0035, color='b', edgecolors=('b'))
+            else:
+                Q = ax.quiver(x, y, dx, dy, units='width', width=0.0035, color=cmap(float(csteps * i) / T))
 
-        ax.axis([0.5, nCols + 0.5, 0.5, nRows + 0.5])
-        ax.set_xticks(np.arange(1, nCols + 1, 2))
-        ax.set_xticklabels(np.arange(0, nCols, 2), fontsize=8)
-        ax.set_yticks(np.arange(1, nRows + 1, 2))
-        ax.set_yticklabels(np.arange(0, nRows, 2), fontsize=8)
-        ax.set_aspect('equal', 'box')
-        ax.set_title("time step {}".format(t), fontsize=12)
+            format_axes(ax, nRows, nCols)
+            ax.set_title("time step {}".format(t), fontsize=12)
 
-    if show_title:
-        fig.suptitle(ddir)
-    plt.tight_layout()
-    plt.subplots_adjust(left=0.125, bottom=0.1, right=0.7, top=0.9,
-                            wspace=0.2, hspace=0.3)
+        if show_title:
+            fig.suptitle(ddir)
+        plt.tight_layout()
+        plt.subplots_adjust(left=0.125, bottom=0.1, right=0.7, top=0.9,
+                                wspace=0.2, hspace=0.3)
 
-    plt.savefig(os.path.join(ddir, 'force_field.pdf'), dpi=300, bbox_inches='tight', pad_inches=0.15)
+    with stage('save'):
+        plt.savefig(output_path(ddir, 'force_field.pdf'), dpi=300, bbox_inches='tight', pad_inches=0.15)
     if not quiet:
         plt.show()
 
+# short options of main(), also checked by plotd.py
+OPTIONS = "cC:hf:m:F:s:S:t:Tqwj:p:"
+
 def main():
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "cC:hs:S:t:Tqw")
+        opts, args = getopt.getopt(sys.argv[1:], OPTIONS, PROFILE_OPTS)
     except getopt.GetoptError, err:
         print(str(err))
         usage()
@@ -162,13 +291,22 @@ def main():
     subplot = None
     show_title = False
     quiet = False
+    jobs = 1
+    workers = 1
     wta = False
+    movie = None
+    fps = 4
+    follow = None
 
     for o, a in opts:
         if o == '-c':
             continuous = True
         elif o == '-C':
             cmap = a
+        elif o == '-m':
+            movie = a
+        elif o == '-F':
+            fps = int(a)
         elif o == '-h':
             usage()
             sys.exit(0)
@@ -183,17 +321,38 @@ def main():
                 sys.exit(-1)
         elif o == '-T':
             show_title = True
+        elif o == '-f':
+            follow = float(a)
+        elif o == '-j':
+            jobs = int(a)
+        elif o == '-p':
+            workers = int(a)
         elif o == '-q':
             quiet = True
         elif o == '-w':
             wta = True
+        elif o.startswith('--profile'):
+            profile_option(o, a)
         else:
             assert False, "unhandled option"
 
+    if jobs > 1:
+        quiet = True
+    if quiet:
+        use_headless()
+
     cmap = get_cmap(cmap, default='Blues')
 
-    for ddir in args:
-        force_fields(ddir, np.array(ts, np.int32), wta, continuous, csteps, subplot, quiet, show_title, cmap=cmap)
+    if movie is not None:
+        # fail before any log is parsed
+        err = movie_error(movie)
+        if err is not None:
+            print(err)
+            sys.exit(-1)
+
+    if run_batch(force_fields, args, (np.array(ts, np.int32), wta, continuous, csteps, subplot, quiet, show_title),
+                 { 'cmap': cmap, 'workers': workers, 'movie': movie, 'fps': fps, 'follow': follow }, jobs) > 0:
+        sys.exit(-1)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# gen_experiment.py -- Generate synthetic drobot experiment directories
+
+import getopt
+import os, sys
+import numpy as np
+from utils import CHUNK_ROWS
+
+def usage():
+    print("""usage: {} [OPTION...] DIRECTORY...
+
+Generate a synthetic experiment in each DIRECTORY with the same files as a
+drobot run: params.log, weights_x/y_in_N.log, out_x/y_in_N.log, in.log and
+reward.log.
+
+options:
+
+  -r ROWS     number of rows of the input grid (default: 5)
+  -c COLS     number of columns of the input grid (default: 5)
+  -o OUTPUTS  number of outputs (default: 5)
+  -t STEPS    number of time steps (default: 1000)
+  -R REWARDS  number of reward channels (default: 2)
+  -s SEED     seed of the random number generator
+  -h          show this help and exit
+""".format(os.path.basename(sys.argv[0])))
+
+def write_params(ddir, nRows, nCols, nOutputs, T):
+    params = [
+        ('time', 0),
+        ('nRowsIn', nRows),
+        ('nColsIn', nCols),
+        ('nOutputs', nOutputs),
+        ('popMinX', -2),
+        ('popMaxX', 2),
+        ('popMinY', -2),
+        ('popMaxY', 2),
+        ('learningRule', 0),
+        ('nTimeSteps', T),
+    ]
+
+    f = open(os.path.join(ddir, 'params.log'), 'w')
+    f.write(','.join(l for l, _ in params) + '\n')
+    f.write(','.join(str(v) for _, v in params) + '\n')
+    f.close()
+
+def gen_experiment(ddir, nRows=5, nCols=5, nOutputs=5, T=1000, nRewards=2, seed=None):
+    if not os.path.isdir(ddir):
+        os.makedirs(ddir)
+
+    rng = np.random.RandomState(seed)
+    nInputs = nRows * nCols
+
+    names = [ "{}_{}_in_{}.log".format(kind, axis, i)
+              for kind in ('weights', 'out') for axis in ('x', 'y') for i in range(nInputs) ]
+    files = [ open(os.path.join(ddir, n), 'w') for n in names ]
+    fin = open(os.path.join(ddir, 'in.log'), 'w')
+    freward = open(os.path.join(ddir, 'reward.log'), 'w')
+
+    # weights start out random and converge by a decaying random walk so the
+    # convergence detection has something to find
+    W = rng.rand(2 * nInputs, nOutputs)
+    for start in range(0, T, CHUNK_ROWS):
+        n = min(CHUNK_ROWS, T - start)
+        time = np.arange(start, start + n).reshape(-1, 1)
+        decay = np.exp(-np.arange(start, start + n) / (0.1 * T)).reshape(-1, 1, 1)
+        steps = 0.01 * decay * rng.standard_normal((n, 2 * nInputs, nOutputs))
+        weights = W + np.cumsum(steps, axis=0)
+        W = weights[-1]
+
+        for i in range(2 * nInputs):
+            np.savetxt(files[i], np.hstack((time, weights[:,i,:])), fmt='%1.12f', delimiter=',')
+            out = np.tanh(weights[:,i,:] + 0.1 * rng.standard_normal((n, nOutputs)))
+            np.savetxt(files[2 * nInputs + i], np.hstack((time, out)), fmt='%1.12f', delimiter=',')
+
+        # one active input field per time step
+        active = np.zeros((n, nInputs), dtype=np.int64)
+        active[np.arange(n), rng.randint(0, nInputs, n)] = 1
+        np.savetxt(fin, np.hstack((time, active)), fmt='%d', delimiter=',')
+
+        rewards = rng.choice([-1, 1], (n, nRewards))
+        np.savetxt(freward, np.hstack((time, rewards)), fmt='%d', delimiter=',')
+
+    for f in files + [ fin, freward ]:
+        f.close()
+
+    # written last, an interrupted run doesn't look like a complete experiment
+    write_params(ddir, nRows, nCols, nOutputs, T)
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "r:c:o:t:R:s:h")
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+        sys.exit(-1)
+
+    if len(args) < 1:
+        usage()
+        sys.exit(-1)
+
+    nRows = 5
+    nCols = 5
+    nOutputs = 5
+    T = 1000
+    nRewards = 2
+    seed = None
+
+    for o, a in opts:
+        if o == '-r':
+            nRows = int(a)
+        elif o == '-c':
+            nCols = int(a)
+        elif o == '-o':
+            nOutputs = int(a)
+        elif o == '-t':
+            T = int(a)
+        elif o == '-R':
+            nRewards = int(a)
+        elif o == '-s':
+            seed = int(a)
+        elif o == '-h':
+            usage()
+            sys.exit(0)
+        else:
+            assert False, "unhandled option"
+
+    for ddir in args:
+        gen_experiment(ddir, nRows, nCols, nOutputs, T, nRewards, seed)
+
+if __name__ == '__main__':
+    main()
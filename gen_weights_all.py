@@ -4,19 +4,53 @@
 import getopt
 import os, sys
 import numpy as np
-from utils import import_params, get_weights, save_weights_all
+from utils import import_params, get_weights_at, weight_steps, save_weights_all, run_batch, WEIGHTS_ALL_FORMATS, \
+        PROFILE_OPTS, profile_option, stage
 
 def usage():
     print("""usage: {} [OPTION...] DIRECTORY...
 
-Generate weights_x_all.log and weights_y_all.log from the weight per input files.
+Generate weights_all_x.log and weights_all_y.log from the weight per input files.
+
+Every row holds the weights of one time step in column-major (Eigen) order,
+preceded by the time stamp (0 if no time steps are given with -t). Only the
+rows of the requested time steps are read from the weight files.
 
 options:
 
+  -t STEP...  comma-separated list (without space) of time steps to write,
+              negative values count from the end and START:STOP:STRIDE
+              selects every STRIDE-th time step as in python (default: -1)
+  -F FORMAT   write weights_all_x/y.FORMAT as text (log, the default), as
+              numpy array (npy) or as raw little-endian doubles (bin)
+  -p PROCS    parse weight files using PROCS processes
+  -j JOBS     process JOBS directories in parallel
+  --profile   print time and peak memory of each processing stage on exit
+  --profile-json=FILE
+              write time and peak memory of each processing stage as JSON
+              to FILE
+  --profile-dump=FILE
+              write cProfile statistics of the slowest stage to FILE
   -h          show this help and exit
 """.format(os.path.basename(sys.argv[0])))
 
-def gen_weights_all(ddir):
+def parse_steps(spec):
+    # time steps are given as indices or START:STOP:STRIDE slices
+    steps = []
+    for s in spec.split(','):
+        if ':' in s:
+            steps.append(slice(*[ int(v) if v else None for v in s.split(':') ]))
+        else:
+            steps.append(int(s))
+    return steps
+
+def resolve_steps(steps, T):
+    ts = []
+    for s in steps:
+        ts.extend(range(T)[s] if isinstance(s, slice) else [s])
+    return ts
+
+def gen_weights_all(ddir, steps=None, ext='log', workers=1):
     params = import_params(ddir)
 
     try:
@@ -29,22 +63,36 @@ def gen_weights_all(ddir):
 
     nInputs = nRows * nCols
 
-    Wx, Wy = get_weights(ddir, nInputs, nOutputs)
-    if Wx is None or Wy is None:
+    with stage('parse'):
+        # slices need the number of time steps, negative indices are
+        # resolved when reading. Both only count complete lines.
+        ts = [ -1 ] if steps is None else steps
+        if any(isinstance(s, slice) for s in ts):
+            ts = resolve_steps(ts, weight_steps(ddir))
+        W = get_weights_at(ddir, nInputs, nOutputs, ts, workers=workers)
+    if W is None:
         print("failed to read weights")
         return
 
-    # take most recent values, strip time and transpose so we can write column wise (like eigen)
-    Wx, Wy = Wx[-1,1:,:].T, Wy[-1,1:,:].T
-    # use final value and reshape to row vector
-    Wx, Wy = np.squeeze(Wx.reshape(-1,1)), np.squeeze(Wy.reshape(-1,1))
-    # prepend dummy time stamp
-    Wx, Wy = np.concatenate(([0.0],Wx)), np.concatenate(([0.0],Wy))
-    save_weights_all(ddir, [Wx], [Wy])
+    with stage('compute'):
+        # transpose so we can write column wise (like eigen) and flatten
+        # every time step to a row vector
+        time, Wx, Wy = W
+        Wx = Wx.transpose(0, 2, 1).reshape(len(time), -1)
+        Wy = Wy.transpose(0, 2, 1).reshape(len(time), -1)
+        # prepend time stamp (dummy one for the final weights)
+        time = time.reshape(-1, 1) if steps is not None else np.zeros((len(time), 1))
+        Wx, Wy = np.hstack((time, Wx)), np.hstack((time, Wy))
+
+    with stage('save'):
+        save_weights_all(ddir, Wx, Wy, ext=ext)
+
+# short options of main(), also checked by plotd.py
+OPTIONS = "ht:F:j:p:"
 
 def main():
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "h")
+        opts, args = getopt.getopt(sys.argv[1:], OPTIONS, PROFILE_OPTS)
     except getopt.GetoptError, err:
         print(str(err))
         usage()
@@ -54,15 +102,37 @@ def main():
         usage()
         sys.exit(-1)
 
+    steps = None
+    ext = 'log'
+    jobs = 1
+    workers = 1
+
     for o, a in opts:
         if o == '-h':
             usage()
             sys.exit(0)
+        elif o == '-t':
+            try:
+                steps = parse_steps(a)
+            except (ValueError, TypeError):
+                print("invalid time steps: {}".format(a))
+                sys.exit(-1)
+        elif o == '-F':
+            if a not in WEIGHTS_ALL_FORMATS:
+                print("unknown format: {}".format(a))
+                sys.exit(-1)
+            ext = a
+        elif o == '-j':
+            jobs = int(a)
+        elif o == '-p':
+            workers = int(a)
+        elif o.startswith('--profile'):
+            profile_option(o, a)
         else:
             assert False, "unhandled option"
 
-    for ddir in args:
-        gen_weights_all(ddir)
+    if run_batch(gen_weights_all, args, kwargs={ 'steps': steps, 'ext': ext, 'workers': workers }, jobs=jobs) > 0:
+        sys.exit(-1)
 
 if __name__ == '__main__':
     main()
@@ -4,8 +4,7 @@
 import getopt
 import os, sys
 import numpy as np
-import matplotlib.pyplot as plt
-from utils import import_params, get_cmap
+from utils import import_params, get_cmap, fit_time_steps, count_rows, read_chunks, tail_log, refresh, run_batch, write_frames, movie_files, movie_error, use_headless, output_path, PROFILE_OPTS, profile_option, stage
 
 def usage():
     print("""usage: {} [OPTION...] DIRECTORY...
@@ -21,11 +20,141 @@ options:
               numbers are intepreted as counting from the end (as in python)
   -s SUBPLOT  specify subplot layout (in matplotlib style, e.g. 23 for 2 rows/3 columns)
   -T          show experiment path in figure title
+  -m FILE     movie mode, write the heat map for every STEP time steps to
+              FILE in the experiment directory (using ffmpeg) or, if FILE
+              ends in .png, to a sequence of numbered PNG files
+  -F FPS      frames per second in movie mode
+  -S STEP     specify time step to use in movie mode
+  -f SECS     follow mode, keep reading data appended to in.log and refresh
+              the plot of the most recent time step every SECS seconds
+              (time and subplot options are ignored, with -q the PDF is
+              rewritten instead)
+  -j JOBS     process JOBS directories in parallel (implies -q)
   -q          quiet mode, don't show plot, only write PDF
+  --profile   print time and peak memory of each processing stage on exit
+  --profile-json=FILE
+              write time and peak memory of each processing stage as JSON
+              to FILE
+  --profile-dump=FILE
+              write cProfile statistics of the slowest stage to FILE
   -h          show this help and exit
 """.format(os.path.basename(sys.argv[0])))
 
-def heatmap(ddir, ts, subplot, quiet, show_title, cmap=None):
+def cumulative_counts(indata):
+    # C[t] holds the number of activations of each input before time step t,
+    # use the smallest unsigned integer type able to hold the final counts
+    indata = np.asarray(indata, dtype=np.int64)
+    dtype = np.min_scalar_type(max(int(indata.sum(axis=0).max()), 0))
+    C = np.zeros((indata.shape[0] + 1, indata.shape[1]), dtype=dtype)
+    np.cumsum(indata, axis=0, dtype=dtype, out=C[1:])
+
+    return C
+
+def activation_counts(blocks, ts):
+    # fold the blocks of in.log into running counts and pick out the counts
+    # before each of the requested time steps in a single pass
+    order = np.argsort(ts, kind='mergesort')
+    counts = None
+    start = 0
+    k = 0
+    for block in blocks:
+        n = block.shape[0]
+        if counts is None:
+            counts = np.zeros((len(ts), block.shape[1]), dtype=np.int64)
+            total = np.zeros(block.shape[1], dtype=np.int64)
+
+        C = cumulative_counts(block)
+        while k < len(ts) and ts[order[k]] <= start + n:
+            counts[order[k]] = total + C[ts[order[k]] - start]
+            k += 1
+
+        total += C[-1]
+        start += n
+
+    return counts.astype(np.min_scalar_type(max(int(counts.max()), 0)))
+
+def add_colorbar(fig, p, ax):
+    cb = fig.colorbar(p, ax=ax, shrink=0.9, pad=0.1, aspect=10)
+    cb.ax.tick_params(labelsize=8)
+    cb.solids.set_edgecolor('face')
+#    cb.set_label('# of stimulations')
+
+def plot_counts(fig, ax, incount, nRows, nCols, cmap, colorbar=True, vmax=None):
+    # the input fields form a regular grid, so an image is drawn instead of
+    # a mesh. Its data and color limits can be updated in place.
+    p = ax.imshow(incount, cmap=cmap, origin='lower', extent=(0, nCols, 0, nRows),
+                  interpolation='nearest', rasterized=True, vmin=0 if vmax is not None else None, vmax=vmax)
+
+    if colorbar:
+        add_colorbar(fig, p, ax)
+    ax.set_aspect('equal', 'box')
+    ax.set_xticks(np.arange(0.5, nCols + 0.5, 2))
+    ax.set_xticklabels(np.arange(0, nCols + 1, 2), fontsize=8)
+    ax.tick_params(axis='x', which='both', bottom='off', top='off', labelbottom='on')
+    ax.set_yticks(np.arange(0.5, nRows + 0.5, 2))
+    ax.set_yticklabels(np.arange(0, nRows + 1, 2), fontsize=8)
+    ax.tick_params(axis='y', which='both', left='off', right='off', labelleft='on')
+    ax.set_xlim(0, nCols)
+    ax.set_ylim(0, nRows)
+
+    return p
+
+def heatmap_follow(ddir, nRows, nCols, interval, quiet, show_title, cmap):
+    import matplotlib.pyplot as plt
+
+    log = tail_log(os.path.join(ddir, 'in.log'))
+    total = np.zeros(nRows * nCols, dtype=np.int64)
+    T = 0
+
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    p = plot_counts(fig, ax, np.zeros((nRows, nCols)), nRows, nCols, cmap)
+    if show_title:
+        fig.suptitle(ddir)
+
+    pdf = output_path(ddir, 'heatmap.pdf') if quiet else None
+    for _ in refresh(fig, interval, pdf):
+        # only the newly appended lines are parsed and added to the counts
+        rows = next(log)
+        if len(rows) == 0:
+            continue
+        total += rows[:,1:].sum(axis=0).astype(np.int64)
+        T += len(rows)
+
+        incount = np.flipud(total.reshape(nRows, nCols))
+        p.set_data(incount)
+        p.set_clim(0, max(incount.max(), 1))
+        ax.set_title("time step {}".format(T - 1), fontsize=12)
+
+def heatmap_movie(fname, counts, ts, nRows, nCols, fps, cmap, title=None):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    # render off-screen into a single figure, only the image data, the color
+    # limits and the title get updated for each frame
+    fig = Figure(figsize=(6, 5), dpi=100)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    p = plot_counts(fig, ax, np.zeros((nRows, nCols)), nRows, nCols, cmap)
+    text = ax.set_title("", fontsize=12)
+    if title is not None:
+        fig.suptitle(title)
+
+    frames = write_frames(fig, fname, fps)
+    next(frames)
+    try:
+        for i, t in enumerate(ts):
+            incount = np.flipud(counts[i].reshape(nRows, nCols))
+            p.set_data(incount)
+            p.set_clim(0, max(incount.max(), 1))
+            text.set_text("time step {}".format(t))
+            next(frames)
+    finally:
+        frames.close()
+
+    return len(ts)
+
+def heatmap(ddir, ts, subplot, quiet, show_title, cmap=None, follow=None, movie=None, fps=4, csteps=10):
     params = import_params(ddir)
 
     try:
@@ -35,62 +164,65 @@ def heatmap(ddir, ts, subplot, quiet, show_title, cmap=None):
         print('necessary parameter not found: ' + str(err))
         sys.exit(-1)
 
-    indata = np.genfromtxt(os.path.join(ddir, 'in.log'), delimiter=',')
+    if follow is not None:
+        heatmap_follow(ddir, nRows, nCols, follow, quiet, show_title, cmap)
+        return
 
-    time = indata[:,0]
-    T = len(time)
-    indata = indata[:,1:]
-    [x, y] = np.meshgrid(np.arange(0, nRows + 1), np.arange(0, nCols + 1))
+    fname = os.path.join(ddir, 'in.log')
+    # in.log is parsed and counted in a single pass
+    with stage('parse'):
+        T = count_rows(fname)
+        if movie is not None:
+            ts = np.arange(1, T, csteps)
+        else:
+            ts = fit_time_steps(ts, T, tmin=1)
+        # the counts only need the rows before the last requested time step
+        counts = activation_counts((chunk[:,1:] for chunk in read_chunks(fname, stop=max(ts))), ts)
 
-    fig = plt.figure()
+    if movie is not None:
+        fname = output_path(ddir, movie)
+        with stage('movie'):
+            n = heatmap_movie(fname, counts, ts, nRows, nCols, fps, cmap, title=ddir if show_title else None)
+        print("{} frames written to {}".format(n, movie_files(fname)))
+        return
 
-    for i, t in enumerate(ts):
-        # use negative indices as in python
-        if t < 0:
-            t = T + t
+    with stage('render'):
+        import matplotlib.pyplot as plt
+        fig = plt.figure()
 
-        if t >= T:
-            t = T - 1
-        elif t < 1:
-            t = 1
+        # all time steps share one color scale, so a single colorbar
+        # serves the whole grid
+        vmax = max(counts.max(), 1)
+        axes = []
+        for i, t in enumerate(ts):
+            incount = counts[i].reshape(nRows,nCols)
+            incount = np.flipud(incount)
 
-        incount = indata[0:t,:].sum(axis=0)
-        incount = incount.reshape(nRows,nCols)
-        incount = np.flipud(incount)
+            if subplot is None:
+                s = '1' + str(len(ts)) + str(i + 1)
+            else:
+                s = subplot + str(i + 1)
 
-        if subplot is None:
-            s = '1' + str(len(ts)) + str(i + 1)
-        else:
-            s = subplot + str(i + 1)
-
-        ax = fig.add_subplot(int(s))
-
-        p = ax.pcolormesh(x, y, incount, cmap=cmap, rasterized=True)
-
-        cb = fig.colorbar(p, ax=ax, shrink=0.9, pad=0.1, aspect=10)
-        cb.ax.tick_params(labelsize=8)
-        cb.solids.set_edgecolor('face')
-#        cb.set_label('# of stimulations')
-        ax.set_aspect('equal', 'box')
-        ax.set_xticks(np.arange(0.5, nCols + 0.5, 2))
-        ax.set_xticklabels(np.arange(0, nCols + 1, 2), fontsize=8)
-        ax.tick_params(axis='x', which='both', bottom='off', top='off', labelbottom='on')
-        ax.set_yticks(np.arange(0.5, nRows + 0.5, 2))
-        ax.set_yticklabels(np.arange(0, nRows + 1, 2), fontsize=8)
-        ax.tick_params(axis='y', which='both', left='off', right='off', labelleft='on')
-        ax.set_xlim(0, nCols)
-        ax.set_ylim(0, nRows)
-        ax.set_title("time step {}".format(t), fontsize=12)
+            ax = fig.add_subplot(int(s))
+            p = plot_counts(fig, ax, incount, nRows, nCols, cmap, colorbar=False, vmax=vmax)
+            ax.set_title("time step {}".format(t), fontsize=12)
+            axes.append(ax)
+        add_colorbar(fig, p, axes)
 
-    if show_title:
-        fig.suptitle(ddir)
-    plt.savefig(os.path.join(ddir, 'heatmap.pdf'), dpi=300, bbox_inches='tight', pad_inches=0.15)
+        if show_title:
+            fig.suptitle(ddir)
+
+    with stage('save'):
+        plt.savefig(output_path(ddir, 'heatmap.pdf'), dpi=300, bbox_inches='tight', pad_inches=0.15)
     if not quiet:
         plt.show()
 
+# short options of main(), also checked by plotd.py
+OPTIONS = "C:f:m:F:S:t:s:Tqhj:"
+
 def main():
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "C:t:s:Tqh")
+        opts, args = getopt.getopt(sys.argv[1:], OPTIONS, PROFILE_OPTS)
     except getopt.GetoptError, err:
         print(str(err))
         usage()
@@ -107,6 +239,11 @@ def main():
     subplot = None
     show_title = False
     quiet = False
+    jobs = 1
+    follow = None
+    movie = None
+    fps = 4
+    csteps = 10
 
     for o, a in opts:
         if o == '-C':
@@ -120,18 +257,43 @@ def main():
             subplot = a
         elif o == '-T':
             show_title = True
+        elif o == '-f':
+            follow = float(a)
+        elif o == '-m':
+            movie = a
+        elif o == '-F':
+            fps = int(a)
+        elif o == '-S':
+            csteps = int(a)
+        elif o == '-j':
+            jobs = int(a)
         elif o == '-q':
             quiet = True
         elif o == '-h':
             usage()
             sys.exit(0)
+        elif o.startswith('--profile'):
+            profile_option(o, a)
         else:
             assert False, "unhandled option"
 
+    if jobs > 1:
+        quiet = True
+    if quiet:
+        use_headless()
+
     cmap = get_cmap(cmap)
 
-    for arg in args:
-        heatmap(arg, np.array(ts, np.int32), subplot, quiet, show_title, cmap=cmap)
+    if movie is not None:
+        # fail before any log is parsed
+        err = movie_error(movie)
+        if err is not None:
+            print(err)
+            sys.exit(-1)
+
+    if run_batch(heatmap, args, (np.array(ts, np.int32), subplot, quiet, show_title),
+                 { 'cmap': cmap, 'follow': follow, 'movie': movie, 'fps': fps, 'csteps': csteps }, jobs) > 0:
+        sys.exit(-1)
 
 if __name__ == '__main__':
     main()
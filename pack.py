@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# pack.py -- Pack drobot experiment directories into single-file archives
+
+import getopt
+import os, sys
+import io
+import json
+import fnmatch
+import itertools
+import zipfile
+import numpy as np
+from utils import import_params, parse_csv, read_chunks, is_archive, archive_manifest, encode_chunk, \
+        ARCHIVE_CHUNK_ROWS, ARCHIVE_EXT, ARCHIVE_MANIFEST, ARCHIVE_VERSION
+
+def usage():
+    print("""usage: {} [OPTION...] DIRECTORY|ARCHIVE...
+
+Pack each experiment DIRECTORY into the archive DIRECTORY{} or unpack each
+ARCHIVE into a directory of the same name (without {}). The archive holds
+params.log and all other logs, parsed and split into chunks of rows, which
+are delta encoded along time and compressed with zlib. All scripts read
+archives in place of experiment directories, only the chunks covering the
+requested time steps are decompressed.
+
+options:
+
+  -u          unpack the given archives
+  -o PATH     name of the archive or directory to create (only with a single
+              DIRECTORY or ARCHIVE)
+  -c ROWS     number of rows per chunk (default: {})
+  -z LEVEL    zlib compression level from 1 (fastest) to 9 (smallest)
+              (default: 6)
+  -r          remove the packed logs or the unpacked archive afterwards, logs
+              are only removed if the archive holds the same values
+  -l          list the logs in the given archives
+  -h          show this help and exit
+""".format(os.path.basename(sys.argv[0]), ARCHIVE_EXT, ARCHIVE_EXT, ARCHIVE_CHUNK_ROWS))
+
+def column_formats(line):
+    # printf formats of the columns as written in the first line, these are
+    # only kept if they reproduce all other lines as well
+    fmt = []
+    for v in line.strip().split(','):
+        if 'e' in v or 'E' in v:
+            fmt.append('%.17g')
+        elif '.' in v:
+            fmt.append('%1.{}f'.format(len(v) - v.index('.') - 1))
+        else:
+            fmt.append('%d')
+    return fmt
+
+def format_rows(chunk, fmt):
+    buf = io.BytesIO()
+    np.savetxt(buf, chunk, fmt=fmt, delimiter=',')
+    return buf.getvalue()
+
+def scan_log(fname, chunk_rows):
+    # check every row of the log: whether all values are integers and
+    # whether the formats of the first line reproduce the log exactly
+    f = open(fname, 'rb')
+    fmt = column_formats(f.readline().decode('utf-8'))
+    f.seek(0)
+    whole = True
+    exact = True
+    try:
+        while True:
+            data = b''.join(itertools.islice(f, chunk_rows))
+            if len(data) == 0:
+                break
+            chunk = parse_csv(data)
+            if chunk.shape[1] != len(fmt):
+                raise ValueError("inconsistent number of columns in {}".format(fname))
+            whole = whole and bool(np.all((chunk == np.round(chunk)) & (np.abs(chunk) < 2**53)))
+            exact = exact and format_rows(chunk, fmt) == data
+    finally:
+        f.close()
+
+    return fmt, whole, exact
+
+def pack_log(z, fname, name, chunk_rows, level):
+    fmt, whole, exact = scan_log(fname, chunk_rows)
+
+    # logs containing only integers (e.g. in.log) are stored as such. If
+    # the first line's formats don't fit all lines, values are written
+    # with as many digits as needed to restore them exactly.
+    dtype = np.int64 if whole else np.float64
+    if not exact:
+        fmt = [ '%d' if whole else '%.17g' ] * len(fmt)
+    rows = 0
+    for k, chunk in enumerate(read_chunks(fname, chunk_rows, dtype=dtype)):
+        if chunk.shape[1] != len(fmt):
+            raise ValueError("inconsistent number of columns in {}".format(fname))
+        # chunks are compressed already
+        z.writestr('{}/{}.dz'.format(name, k), encode_chunk(chunk, level), zipfile.ZIP_STORED)
+        rows += len(chunk)
+
+    return { 'rows': rows, 'cols': len(fmt) if rows > 0 else 0, 'dtype': np.dtype(dtype).name, 'fmt': fmt }
+
+def pack(ddir, archive, chunk_rows=ARCHIVE_CHUNK_ROWS, level=6, remove=False):
+    params = import_params(ddir)
+    if params is None:
+        return False
+
+    manifest = {
+        'version': ARCHIVE_VERSION,
+        'chunk_rows': chunk_rows,
+        'params': params,
+        'logs': {},
+        'files': [],
+    }
+
+    names = sorted(fnmatch.filter(os.listdir(ddir), '*.log'))
+    z = zipfile.ZipFile(archive + '.tmp', 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+    try:
+        for name in names:
+            fname = os.path.join(ddir, name)
+            try:
+                if name == 'params.log':
+                    raise ValueError("parameters are stored as text")
+                manifest['logs'][name] = pack_log(z, fname, name, chunk_rows, level)
+            except ValueError:
+                # anything that doesn't parse as numbers is kept as it is
+                z.write(fname, name)
+                manifest['files'].append(name)
+        z.writestr(ARCHIVE_MANIFEST, json.dumps(manifest, indent=1, sort_keys=True))
+        z.close()
+    except:
+        z.close()
+        os.remove(archive + '.tmp')
+        raise
+    os.rename(archive + '.tmp', archive)
+
+    print("{} logs of {} packed into {}".format(len(names), ddir, archive))
+    if remove and not verify(archive, ddir):
+        print("{} differs from {}, logs not removed".format(archive, ddir))
+        return False
+    if remove:
+        for name in names:
+            os.remove(os.path.join(ddir, name))
+        if len(os.listdir(ddir)) == 0:
+            os.rmdir(ddir)
+
+    return True
+
+def same_values(a, b):
+    return a.shape == b.shape and bool(np.all((a == b) | (np.isnan(a) & np.isnan(b))))
+
+def verify(archive, ddir):
+    # compare every log in the archive to the one it was packed from
+    manifest = archive_manifest(archive)
+    z = zipfile.ZipFile(archive, 'r', allowZip64=True)
+    try:
+        for name in manifest['files']:
+            f = open(os.path.join(ddir, name), 'rb')
+            data = f.read()
+            f.close()
+            if z.read(name) != data:
+                return False
+    finally:
+        z.close()
+
+    n = manifest['chunk_rows']
+    for name in manifest['logs']:
+        packed = read_chunks(os.path.join(archive, name), n)
+        for chunk in read_chunks(os.path.join(ddir, name), n):
+            if not same_values(next(packed, np.zeros((0, 0))).astype(np.float64), chunk):
+                return False
+        if next(packed, None) is not None:
+            return False
+
+    return True
+
+def unpack(archive, ddir, remove=False):
+    manifest = archive_manifest(archive)
+    if not os.path.isdir(ddir):
+        os.makedirs(ddir)
+
+    z = zipfile.ZipFile(archive, 'r', allowZip64=True)
+    for name in manifest['files']:
+        f = open(os.path.join(ddir, name), 'wb')
+        f.write(z.read(name))
+        f.close()
+    z.close()
+
+    for name, log in sorted(manifest['logs'].items()):
+        f = open(os.path.join(ddir, name), 'wb')
+        for chunk in read_chunks(os.path.join(archive, name), dtype=log['dtype']):
+            np.savetxt(f, chunk, fmt=log['fmt'], delimiter=',')
+        f.close()
+
+    print("{} logs of {} unpacked into {}".format(len(manifest['logs']) + len(manifest['files']), archive, ddir))
+    if remove:
+        os.remove(archive)
+
+    return True
+
+def list_archive(archive):
+    manifest = archive_manifest(archive)
+    z = zipfile.ZipFile(archive, 'r', allowZip64=True)
+    sizes = {}
+    for info in z.infolist():
+        name = info.filename.split('/')[0]
+        s = sizes.setdefault(name, [0, 0])
+        s[0] += info.file_size
+        s[1] += info.compress_size
+    z.close()
+
+    print("{}: {} rows per chunk".format(archive, manifest['chunk_rows']))
+    for name in sorted(list(manifest['logs']) + manifest['files']):
+        log = manifest['logs'].get(name)
+        shape = "{} x {}".format(log['rows'], log['cols']) if log is not None else 'text'
+        print("  {:<24} {:>16} {:>12} {:>12}".format(name, shape, sizes[name][0], sizes[name][1]))
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "uo:c:z:rlh")
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+        sys.exit(-1)
+
+    if len(args) < 1:
+        usage()
+        sys.exit(-1)
+
+    mode = 'pack'
+    out = None
+    chunk_rows = ARCHIVE_CHUNK_ROWS
+    level = 6
+    remove = False
+
+    for o, a in opts:
+        if o == '-u':
+            mode = 'unpack'
+        elif o == '-o':
+            out = a
+        elif o == '-c':
+            chunk_rows = int(a)
+        elif o == '-z':
+            level = int(a)
+        elif o == '-r':
+            remove = True
+        elif o == '-l':
+            mode = 'list'
+        elif o == '-h':
+            usage()
+            sys.exit(0)
+        else:
+            assert False, "unhandled option"
+
+    if out is not None and len(args) > 1:
+        print("-o can only be used with a single directory or archive")
+        sys.exit(-1)
+
+    failed = 0
+    for path in args:
+        try:
+            if mode == 'list':
+                list_archive(path)
+            elif mode == 'unpack':
+                if not is_archive(path):
+                    raise ValueError("not an archive")
+                unpack(path, out or (path[:-len(ARCHIVE_EXT)] if path.endswith(ARCHIVE_EXT) else path + '.d'), remove)
+            elif not pack(path.rstrip(os.sep), out or path.rstrip(os.sep) + ARCHIVE_EXT, chunk_rows, level, remove):
+                failed += 1
+        except (IOError, OSError, ValueError) as err:
+            print("{}: {}".format(path, err))
+            failed += 1
+
+    if failed > 0:
+        sys.exit(-1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# *-* coding: utf-8 -*-
+#
+# params_index.py -- Persistent index of drobot experiment parameters
+#
+# The index is an SQLite database recording the parameters of every
+# experiment directory below a tree together with the modification times
+# needed to update it incrementally: directories whose mtime didn't change
+# aren't listed again and params.log is only re-read if it changed.
+# Experiment archives (see pack.py) are indexed like directories, they are
+# re-read if the archive changed. Queries only read the index, it is brought
+# up to date by update_index.
+
+import os
+import stat
+import sqlite3
+from collections import OrderedDict
+from utils import import_params, is_archive, ARCHIVE_EXT
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime REAL,
+    subdirs TEXT
+);
+CREATE TABLE IF NOT EXISTS experiments (
+    path TEXT PRIMARY KEY,
+    params_mtime REAL,
+    params_size INTEGER
+);
+CREATE TABLE IF NOT EXISTS params (
+    path TEXT,
+    pos INTEGER,
+    name TEXT,
+    value TEXT,
+    PRIMARY KEY (path, name)
+);
+CREATE INDEX IF NOT EXISTS params_name_value ON params (name, value);
+"""
+# version 1 lists archives along with subdirectories
+SCHEMA_VERSION = 1
+
+def open_index(fname):
+    db = sqlite3.connect(fname)
+    db.executescript(SCHEMA)
+    # directory listings of older versions lack the archives, list again
+    if db.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+        db.execute('DELETE FROM dirs')
+        db.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+        db.commit()
+    return db
+
+def _prefix(root):
+    return root if root.endswith(os.sep) else root + os.sep
+
+def _forget(db, path):
+    db.execute('DELETE FROM experiments WHERE path = ?', (path,))
+    db.execute('DELETE FROM params WHERE path = ?', (path,))
+
+def _update_experiment(db, d, params_file, stats, archive=False):
+    # the parameters in an archive only change along with the archive
+    p = d if archive else os.path.join(d, params_file)
+    try:
+        st = os.stat(p)
+    except OSError:
+        _forget(db, d)
+        return
+
+    row = db.execute('SELECT params_mtime, params_size FROM experiments WHERE path = ?', (d,)).fetchone()
+    if row is not None and row[0] == st.st_mtime and row[1] == st.st_size:
+        return
+
+    _forget(db, d)
+    params = import_params(d, params_file, verbose=False)
+    stats['read'] += 1
+    if not params:
+        return
+
+    db.execute('INSERT INTO experiments VALUES (?, ?, ?)', (d, st.st_mtime, st.st_size))
+    db.executemany('INSERT OR REPLACE INTO params VALUES (?, ?, ?, ?)',
+            [ (d, i, l, v) for i, (l, v) in enumerate(params.items()) ])
+
+def _scan(db, d, params_file, visited, stats):
+    try:
+        st = os.stat(d)
+    except OSError:
+        return
+
+    visited.add(d)
+    if stat.S_ISREG(st.st_mode):
+        _update_experiment(db, d, params_file, stats, archive=True)
+        return
+
+    # only list directories which changed since the last scan
+    row = db.execute('SELECT mtime, subdirs FROM dirs WHERE path = ?', (d,)).fetchone()
+    if row is not None and row[0] == st.st_mtime:
+        subdirs = row[1].split('\n') if row[1] else []
+    else:
+        subdirs = sorted([ dd for dd in os.listdir(d) if os.path.isdir(os.path.join(d, dd)) or
+                           (dd.endswith(ARCHIVE_EXT) and is_archive(os.path.join(d, dd))) ])
+        db.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)', (d, st.st_mtime, '\n'.join(subdirs)))
+        stats['listed'] += 1
+
+    _update_experiment(db, d, params_file, stats)
+
+    for dd in subdirs:
+        _scan(db, os.path.join(d, dd), params_file, visited, stats)
+
+def indexed(db, root):
+    # whether the tree below root was scanned before
+    root = os.path.abspath(root)
+    return db.execute('SELECT 1 FROM dirs WHERE path = ? UNION SELECT 1 FROM experiments WHERE path = ?',
+            (root, root)).fetchone() is not None
+
+def update_index(db, root, params_file='params.log'):
+    # bring the index up to date for the tree below root, returns the number
+    # of directories listed and parameter files read
+    root = os.path.abspath(root)
+    visited = set()
+    stats = { 'listed': 0, 'read': 0 }
+    _scan(db, root, params_file, visited, stats)
+
+    # remove directories below root which don't exist anymore
+    for table in ('dirs', 'experiments'):
+        rows = db.execute('SELECT path FROM {} WHERE path = ? OR substr(path, 1, ?) = ?'.format(table),
+                (root, len(_prefix(root)), _prefix(root))).fetchall()
+        for (path,) in rows:
+            if path not in visited:
+                db.execute('DELETE FROM dirs WHERE path = ?', (path,))
+                _forget(db, path)
+
+    db.commit()
+    return stats['listed'], stats['read']
+
+def query_index(db, root, conditions=()):
+    # return all experiment directories below root whose parameters match all
+    # (name, value) pairs in conditions, numeric values are compared as numbers
+    root = os.path.abspath(root)
+    sql = 'SELECT path FROM experiments WHERE (path = ? OR substr(path, 1, ?) = ?)'
+    args = [ root, len(_prefix(root)), _prefix(root) ]
+    for name, value in conditions:
+        try:
+            value = float(value)
+            sql += ' AND path IN (SELECT path FROM params WHERE name = ? AND CAST(value AS REAL) = ?)'
+        except ValueError:
+            sql += ' AND path IN (SELECT path FROM params WHERE name = ? AND value = ?)'
+        args.extend([ name, value ])
+    sql += ' ORDER BY path'
+
+    return [ path for (path,) in db.execute(sql, args) ]
+
+def get_params(db, path):
+    rows = db.execute('SELECT name, value FROM params WHERE path = ? ORDER BY pos', (path,))
+    return OrderedDict(rows.fetchall())
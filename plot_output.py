@@ -6,58 +6,141 @@ import os, sys
 import fnmatch
 import re
 import numpy as np
-import matplotlib.pyplot as plt
-from utils import import_params, get_cmap
+from utils import import_params, get_cmap, load_csv, count_rows, count_columns, log_exists, use_headless, output_path, PROFILE_OPTS, profile_option, stage
 
 def usage():
     print("""usage: {} [OPTION...] DIRECTORY...
 
 Show plot of development of network output.
 
-  -C CMAP     use CMAP as colormap in continuous mode, see help(colormaps) in
-              matplotlib for a list
+For every input, the output of the network is drawn for every STEP time
+steps, more recent time steps are drawn darker and the last one is
+emphasized. Pan (x) and tilt (y) outputs are plotted into separate figures.
+
+options:
+
+  -C CMAP     use CMAP as colormap, see help(colormaps) in matplotlib for a
+              list
+  -S STEP     specify time step to use (default: number of time steps
+              divided by the number of inputs, as in plot_output.m)
+  -T          show experiment path in figure title
   -q          quiet mode, don't show plot, only write PDF
+  --profile   print time and peak memory of each processing stage on exit
+  --profile-json=FILE
+              write time and peak memory of each processing stage as JSON
+              to FILE
+  --profile-dump=FILE
+              write cProfile statistics of the slowest stage to FILE
   -h          show this help and exit
 """.format(os.path.basename(sys.argv[0])))
 
-def plot_output(ddir, quiet, cmap):
+def output_files(ddir, axis, nInputs):
+    return [ os.path.join(ddir, "out_{}_in_{}.log".format(axis, i)) for i in range(nInputs) ]
+
+def load_outputs(ddir, nInputs, axes=('x', 'y')):
+    # load the outputs of all axes which have logs into a single array of
+    # shape (len(axes), nInputs, T, nOutputs). If the axes have a different
+    # number of outputs the missing ones are NaN. Logs of a running
+    # experiment may differ in length, all are cut to the shortest one.
+    axes = [ a for a in axes if log_exists(output_files(ddir, a, nInputs)[0]) ]
+    files = [ output_files(ddir, a, nInputs) for a in axes ]
+    if len(files) == 0:
+        raise ValueError("no output logs found in {}".format(ddir))
+
+    T = min(count_rows(f) for names in files for f in names)
+    nOutputs = [ count_columns(names[0]) - 1 for names in files ]
+
+    outputs = np.empty((len(axes), nInputs, T, max(nOutputs)))
+    outputs.fill(np.nan)
+    for k, names in enumerate(files):
+        for i, f in enumerate(names):
+            data = load_csv(f)
+            if data.shape[1] - 1 != nOutputs[k]:
+                raise ValueError("invalid number of outputs in {}".format(f))
+            # strip off time
+            outputs[k,i,:,:nOutputs[k]] = data[:T,1:]
+
+    return axes, outputs, nOutputs
+
+def plot_outputs(axes, outputs, nOutputs, nRows, nCols, ts, cmap):
+    from matplotlib.collections import LineCollection
+
+    nInputs = nRows * nCols
+    x = np.arange(nOutputs)
+    colors = cmap(np.linspace(0.2, 1.0, len(ts)))
+    widths = np.full(len(ts), 0.5)
+    widths[-1] = 1.25
+
+    lo, hi = np.nanmin(outputs[:,ts,:nOutputs]), np.nanmax(outputs[:,ts,:nOutputs])
+    margin = 0.05 * (hi - lo) if hi > lo else 0.5
+
+    for i in range(nInputs):
+        # same layout as the heat map: input 0 in the lower left corner
+        r, c = nRows - 1 - i // nCols, i % nCols
+        ax = axes[r,c]
+
+        # all time steps of an input are drawn as a single collection
+        segments = np.empty((len(ts), nOutputs, 2))
+        segments[:,:,0] = x
+        segments[:,:,1] = outputs[i,ts,:nOutputs]
+        ax.add_collection(LineCollection(segments, colors=colors, linewidths=widths))
+
+        ax.set_title("input {}".format(i), fontsize=8)
+        ax.set_xlim(0, nOutputs - 1)
+        ax.set_ylim(lo - margin, hi + margin)
+        ax.tick_params(labelsize=8)
+        if r == nRows - 1:
+            ax.set_xlabel('output unit', fontsize=8)
+        if c == 0:
+            ax.set_ylabel('activity', fontsize=8)
+
+def plot_output(ddir, quiet, cmap, csteps=None, show_title=False):
     params = import_params(ddir)
 
     try:
         nRows = int(params['nRowsIn'])
         nCols = int(params['nColsIn'])
-        nOutputs = int(params['nOutputs'])
     except KeyError, err:
         print('necessary parameter not found: ' + str(err))
         sys.exit(-1)
 
     nInputs = nRows * nCols
 
-    # XXX: get this from the files themselves
-    T = 5
-
-    outputs = np.zeros([T, nOutputs, nInputs])
-
-    fig, axes = plt.subplots(1, nInputs, sharex=True, sharey=True)
-
-    for i in range(nInputs):
-        tmp = np.genfromtxt(os.path.join(ddir, "out_x_in_{}.log".format(i)), delimiter=',')
-        outputs[:,:,i] = tmp[:,1:]
-
-    for i in range(nInputs):
-        for t in range(T):
-            ax = axes[i]
-            ax.set_title("input {}".format(i))
-            ax.plot(outputs[t,:,i], color=cmap(float(0.2 + t) / T))
-            ax.set_xlim(0.0, float(nOutputs - 1))
-            ax.set_ylim(-1.5, 1.5)
-            ax.set_aspect(5, 'box-forced')
-
-    plt.show()
+    with stage('parse'):
+        try:
+            axes, outputs, nOutputs = load_outputs(ddir, nInputs)
+        except ValueError as err:
+            print(str(err))
+            return
+
+    T = outputs.shape[2]
+    if csteps is None:
+        csteps = max(T // nInputs, 1)
+    # always show the last time step
+    ts = np.arange(0, T, csteps)
+    if len(ts) == 0 or ts[-1] != T - 1:
+        ts = np.append(ts, T - 1)
+
+    with stage('render'):
+        import matplotlib.pyplot as plt
+
+        figs = []
+        for k, axis in enumerate(axes):
+            fig, axs = plt.subplots(nRows, nCols, sharex=True, sharey=True, squeeze=False)
+            plot_outputs(axs, outputs[k], nOutputs[k], nRows, nCols, ts, cmap)
+            title = 'pan (X)' if axis == 'x' else 'tilt (Y)'
+            fig.suptitle(title + '\n' + ddir if show_title else title)
+            figs.append((axis, fig))
+
+    with stage('save'):
+        for axis, fig in figs:
+            fig.savefig(output_path(ddir, 'output_{}.pdf'.format(axis)), dpi=300, bbox_inches='tight', pad_inches=0.15)
+    if not quiet:
+        plt.show()
 
 def main():
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "C:hq")
+        opts, args = getopt.getopt(sys.argv[1:], "C:S:Thq", PROFILE_OPTS)
     except getopt.GetoptError, err:
         print(str(err))
         usage()
@@ -68,23 +151,34 @@ def main():
         sys.exit(-1)
 
     cmap = None
+    csteps = None
+    show_title = False
     quiet = False
 
     for o, a in opts:
         if o == '-C':
             cmap = a
+        elif o == '-S':
+            csteps = int(a)
+        elif o == '-T':
+            show_title = True
         elif o == '-h':
             usage()
             sys.exit(0)
         elif o == '-q':
             quiet = True
+        elif o.startswith('--profile'):
+            profile_option(o, a)
         else:
             assert False, "unhandled option"
 
+    if quiet:
+        use_headless()
+
     cmap = get_cmap(cmap, default='Blues')
 
     for ddir in args:
-        plot_output(ddir, quiet, cmap=cmap)
+        plot_output(ddir, quiet, cmap, csteps, show_title)
 
 if __name__ == '__main__':
     main()
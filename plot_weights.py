@@ -4,8 +4,7 @@
 import getopt
 import os, sys
 import numpy as np
-import matplotlib.pyplot as plt
-from utils import import_params, get_weights, get_cmap
+from utils import import_params, get_weights_compact, weight_steps, get_cmap, fit_time_steps, run_batch, weight_changes, convergence_step, write_frames, movie_files, movie_error, use_headless, output_path, PROFILE_OPTS, profile_option, stage
 
 def usage():
     print("""usage: {} [OPTION...] DIRECTORY...
@@ -18,16 +17,34 @@ options:
   -t TIME...  comma-separated list (without space) of timestamps, negative
               numbers are intepreted as counting from the end (as in python)
   -T          show experiment path in figure title
+  -m FILE     movie mode, write the pan and tilt weights for every STEP time
+              steps to FILE in the experiment directory (using ffmpeg) or, if
+              FILE ends in .png, to a sequence of numbered PNG files
+  -F FPS      frames per second in movie mode
+  -S STEP     specify time step to use in movie mode
+  -e EPS      report the first time step after which the norm of the weight
+              change per time step stays below EPS, overall and per input
+  -p PROCS    parse weight files using PROCS processes
+  -j JOBS     process JOBS directories in parallel (implies -q)
   -q          quiet mode, don't show plot, only write PDF
+  --profile   print time and peak memory of each processing stage on exit
+  --profile-json=FILE
+              write time and peak memory of each processing stage as JSON
+              to FILE
+  --profile-dump=FILE
+              write cProfile statistics of the slowest stage to FILE
   -h          show this help and exit
 """.format(os.path.basename(sys.argv[0])))
 
-def plot_one(t, x, y, W, nInputs, nOutputs, fig, ax, cmap, last):
+def plot_one(t, w, nInputs, nOutputs, fig, ax, cmap, last):
     if last:
         ax.set_xlabel('inputs', fontsize=8)
     ax.set_ylabel('outputs', fontsize=8)
 
-    p = ax.pcolormesh(x, y, W[t,:,:], cmap=cmap, rasterized=True)
+    # weights form a regular grid, so an image is drawn instead of a mesh.
+    # Its data and color limits can be updated in place.
+    p = ax.imshow(w, cmap=cmap, origin='lower', extent=(0, nInputs, 0, nOutputs),
+                  aspect='auto', interpolation='nearest', rasterized=True)
 
     cb = fig.colorbar(p, ax=ax, shrink=0.9, pad=0.1, aspect=10)
     cb.ax.tick_params(labelsize=8)
@@ -43,7 +60,51 @@ def plot_one(t, x, y, W, nInputs, nOutputs, fig, ax, cmap, last):
     ax.set_ylim(0, nOutputs)
     ax.set_title("time step {}".format(t), fontsize=10)
 
-def weights(ddir, ts, quiet, show_title, cmap):
+    return p
+
+def weights_movie(fname, Wx, Wy, nInputs, nOutputs, csteps, fps, cmap, title=None):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    T = Wx.shape[0]
+    ts = np.arange(0, T, csteps)
+
+    # render off-screen into a single figure with pan and tilt weights below
+    # each other, only the image data, the color limits and the titles get
+    # updated for each frame
+    fig = Figure(figsize=(6, 6), dpi=100)
+    FigureCanvasAgg(fig)
+    axx = fig.add_subplot(211)
+    axy = fig.add_subplot(212, sharex=axx)
+    px = plot_one(0, Wx[0,:,:], nInputs, nOutputs, fig, axx, cmap, False)
+    py = plot_one(0, Wy[0,:,:], nInputs, nOutputs, fig, axy, cmap, True)
+    if title is not None:
+        fig.suptitle(title)
+
+    frames = write_frames(fig, fname, fps)
+    next(frames)
+    try:
+        for t in ts:
+            for W, p, ax, label in ((Wx, px, axx, 'pan (X)'), (Wy, py, axy, 'tilt (Y)')):
+                p.set_data(W[t,:,:])
+                p.set_clim(W[t,:,:].min(), W[t,:,:].max())
+                ax.title.set_text("{}, time step {}".format(label, t))
+            next(frames)
+    finally:
+        frames.close()
+
+    return len(ts)
+
+def report_convergence(ddir, label, axis, eps):
+    time, per_input, overall = weight_changes(ddir, axis)
+    t = convergence_step(overall, eps)
+    if t < 0:
+        print("{} {}: not converged, last change {:g}".format(ddir, label, overall[-1]))
+    else:
+        print("{} {}: converged at time step {} (time {:g})".format(ddir, label, t, time[t]))
+    print("  per input: {}".format(' '.join(str(s) for s in convergence_step(per_input, eps))))
+
+def weights(ddir, ts, quiet, show_title, cmap, workers=1, eps=None, movie=None, fps=4, csteps=10):
     params = import_params(ddir)
 
     try:
@@ -56,46 +117,63 @@ def weights(ddir, ts, quiet, show_title, cmap):
 
     nInputs = nRows * nCols
 
-    Wx, Wy = get_weights(ddir, nInputs, nOutputs)
-    if Wx is None or Wy is None:
+    if eps is not None:
+        # the weight logs are streamed, not loaded at once
+        with stage('compute'):
+            report_convergence(ddir, 'pan (X)', 'x', eps)
+            report_convergence(ddir, 'tilt (Y)', 'y', eps)
+
+    # only the requested time steps are read unless all of them are needed
+    selected = movie is None
+    with stage('parse'):
+        W = get_weights_compact(ddir, nInputs, nOutputs, np.float32, workers=workers,
+                                ts=ts if selected else None)
+    if W is None:
         print("failed to read weights")
         return
 
-    time = Wx[:,0,0]
-    T = len(time)
-    # omit time
-    Wx = Wx[:,1:,:]
-    Wy = Wy[:,1:,:]
-
-    [x, y] = np.meshgrid(np.arange(0, nInputs + 1), np.arange(0, nOutputs + 1))
+    time, Wx, Wy = W
+    T = weight_steps(ddir) if selected else len(time)
 
-    N = len(ts)
+    if movie is not None:
+        fname = output_path(ddir, movie)
+        with stage('movie'):
+            n = weights_movie(fname, Wx, Wy, nInputs, nOutputs, csteps, fps, cmap,
+                              title=ddir if show_title else None)
+        print("{} frames written to {}".format(n, movie_files(fname)))
+        return
 
-    figx, axesx = plt.subplots(N, sharex=True)
-    figy, axesy = plt.subplots(N, sharex=True)
+    with stage('render'):
+        import matplotlib.pyplot as plt
+        N = len(ts)
 
-    figx.suptitle('pan (X)')
-    figy.suptitle('tilt (Y)')
+        figx, axesx = plt.subplots(N, sharex=True, squeeze=False)
+        figy, axesy = plt.subplots(N, sharex=True, squeeze=False)
 
-    for i, t in enumerate(ts):
-        # use negative indices as in python
-        if t < 0:
-            t = T + t
+        figx.suptitle('pan (X)')
+        figy.suptitle('tilt (Y)')
 
-        if t >= T:
-            t = T - 1
-        elif t < 0:
-            t = 0
+        for i, t in enumerate(fit_time_steps(ts, T)):
+            j = i if selected else t
+            plot_one(t, Wx[j,:,:], nInputs, nOutputs, figx, axesx[i,0], cmap, i == len(ts) - 1)
+            plot_one(t, Wy[j,:,:], nInputs, nOutputs, figy, axesy[i,0], cmap, i == len(ts) - 1)
 
-        plot_one(t, x, y, Wx, nInputs, nOutputs, figx, axesx[i], cmap, i == len(ts) - 1)
-        plot_one(t, x, y, Wy, nInputs, nOutputs, figy, axesy[i], cmap, i == len(ts) - 1)
+        if show_title:
+            figx.suptitle('pan (X)\n' + ddir)
+            figy.suptitle('tilt (Y)\n' + ddir)
 
+    with stage('save'):
+        figx.savefig(output_path(ddir, 'weights_x.pdf'), dpi=300, bbox_inches='tight', pad_inches=0.15)
+        figy.savefig(output_path(ddir, 'weights_y.pdf'), dpi=300, bbox_inches='tight', pad_inches=0.15)
     if not quiet:
         plt.show()
 
+# short options of main(), also checked by plotd.py
+OPTIONS = "c:e:m:F:S:t:Tqhj:p:"
+
 def main():
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "c:t:Tqh")
+        opts, args = getopt.getopt(sys.argv[1:], OPTIONS, PROFILE_OPTS)
     except getopt.GetoptError, err:
         print(str(err))
         usage()
@@ -110,6 +188,12 @@ def main():
     ts = [-1]
     show_title = False
     quiet = False
+    jobs = 1
+    eps = None
+    workers = 1
+    movie = None
+    fps = 4
+    csteps = 10
 
     for o, a in opts:
         if o == '-c':
@@ -121,16 +205,43 @@ def main():
                 sys.exit(-1)
         elif o == '-T':
             show_title = True
+        elif o == '-e':
+            eps = float(a)
+        elif o == '-m':
+            movie = a
+        elif o == '-F':
+            fps = int(a)
+        elif o == '-S':
+            csteps = int(a)
+        elif o == '-j':
+            jobs = int(a)
+        elif o == '-p':
+            workers = int(a)
         elif o == '-q':
             quiet = True
         elif o == '-h':
             usage()
             sys.exit(0)
+        elif o.startswith('--profile'):
+            profile_option(o, a)
         else:
             assert False, "unhandled option"
 
-    for ddir in args:
-        weights(ddir, np.array(ts, np.int32), quiet, show_title, get_cmap(cmap))
+    if jobs > 1:
+        quiet = True
+    if quiet:
+        use_headless()
+
+    if movie is not None:
+        # fail before any log is parsed
+        err = movie_error(movie)
+        if err is not None:
+            print(err)
+            sys.exit(-1)
+
+    if run_batch(weights, args, (np.array(ts, np.int32), quiet, show_title, get_cmap(cmap)),
+                 { 'workers': workers, 'eps': eps, 'movie': movie, 'fps': fps, 'csteps': csteps }, jobs) > 0:
+        sys.exit(-1)
 
 if __name__ == '__main__':
     main()
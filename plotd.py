@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# plotd.py -- Plot server keeping parsed experiments in memory
+#
+# The server runs the plotting scripts in its own process on request, so
+# matplotlib is only imported once and logs parsed by an earlier request are
+# reused as long as they didn't change. The client side only needs the
+# standard library and starts fast.
+
+import getopt
+import os, sys
+import json
+import socket
+import tempfile
+import traceback
+
+# scripts the server runs and the options forcing them not to show a window
+SCRIPTS = {
+    'force_fields': [ '-q' ],
+    'heatmap': [ '-q' ],
+    'reward': [ '-q' ],
+    'plot_weights': [ '-q' ],
+    'gen_weights_all': [],
+}
+
+# options which would keep the server busy forever (follow mode) or run the
+# script in other processes, which don't share the server's parsed logs
+UNSUPPORTED = [ '-f', '-j', '-p' ]
+
+def usage():
+    print("""usage: {0} [OPTION...] [SCRIPT [ARG...]]
+
+Run SCRIPT (one of {1}) with
+the given arguments in a plot server, which keeps parsed logs of previous
+requests in memory. Plots are always written to PDF (as with -q), follow
+mode (-f), parallel processing (-j, -p) and profiling (--profile) are not
+supported. Start the server with -S first.
+
+options:
+
+  -S          start the server in the foreground
+  -s SOCKET   Unix socket of the server (default: {2})
+  -M MBYTES   memory budget of the server for parsed logs (default: 1024)
+  -i          show cache statistics of the server
+  -k          stop the server
+  -h          show this help and exit
+""".format(os.path.basename(sys.argv[0]), ', '.join(sorted(SCRIPTS)), default_socket()))
+
+def default_socket():
+    return os.path.join(tempfile.gettempdir(), 'plotd-{}.sock'.format(os.getuid()))
+
+def send(conn, msg):
+    conn.sendall(json.dumps(msg).encode('utf-8') + b'\n')
+
+def receive(conn):
+    f = conn.makefile('rb')
+    line = f.readline()
+    f.close()
+    if not line:
+        raise IOError("connection closed")
+    return json.loads(line.decode('utf-8'))
+
+def run_script(req):
+    # run the script's main() as if it was called from the command line in
+    # the client's working directory and return its exit status and output
+    try:
+        from StringIO import StringIO
+    except ImportError:
+        from io import StringIO
+
+    from utils import PROFILE_OPTS
+
+    name = req['script']
+    if name not in SCRIPTS:
+        return { 'status': -1, 'output': "unknown script: {}\n".format(name) }
+
+    # parse the arguments as the script will, so combined short options
+    # can't slip through
+    module = __import__(name)
+    try:
+        opts, _ = getopt.getopt(req['argv'], module.OPTIONS, PROFILE_OPTS)
+    except getopt.GetoptError as err:
+        return { 'status': -1, 'output': "{}\n".format(err) }
+    for o, _ in opts:
+        if o in UNSUPPORTED or o.startswith('--profile'):
+            return { 'status': -1, 'output': "option not supported by the server: {}\n".format(o) }
+
+    argv, stdout, cwd = sys.argv, sys.stdout, os.getcwd()
+    sys.argv = [ name + '.py' ] + SCRIPTS[name] + req['argv']
+    sys.stdout = StringIO()
+    status = 0
+    try:
+        os.chdir(req['cwd'])
+        module.main()
+    except SystemExit as err:
+        status = err.code if isinstance(err.code, int) else (0 if err.code is None else 1)
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+        status = 1
+    finally:
+        output = sys.stdout.getvalue()
+        sys.argv, sys.stdout = argv, stdout
+        os.chdir(cwd)
+        if 'matplotlib.pyplot' in sys.modules:
+            sys.modules['matplotlib.pyplot'].close('all')
+
+    return { 'status': status, 'output': output }
+
+def serve(path, budget):
+    from utils import use_headless, enable_memory_cache, memory_cache_stats
+
+    # import everything a request may need up front
+    use_headless()
+    import matplotlib.pyplot
+    for name in SCRIPTS:
+        __import__(name)
+    enable_memory_cache(budget)
+
+    # a socket file nobody listens on is left over from a crashed server
+    if os.path.exists(path):
+        try:
+            request(path, { 'command': 'stats' })
+            print("server already running on {}".format(path))
+            sys.exit(-1)
+        except socket.error:
+            os.unlink(path)
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.bind(path)
+    s.listen(5)
+    print("listening on {}".format(path))
+    sys.stdout.flush()
+
+    # requests are served one at a time, matplotlib isn't thread-safe
+    try:
+        while True:
+            conn, _ = s.accept()
+            try:
+                req = receive(conn)
+                command = req.get('command', 'run')
+                if command == 'run':
+                    send(conn, run_script(req))
+                elif command == 'stats':
+                    send(conn, { 'status': 0, 'stats': memory_cache_stats() })
+                elif command == 'stop':
+                    send(conn, { 'status': 0 })
+                    break
+                else:
+                    send(conn, { 'status': -1, 'output': "unknown command: {}\n".format(command) })
+            except (IOError, ValueError, KeyError) as err:
+                sys.stderr.write("invalid request: {}\n".format(err))
+            finally:
+                conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        s.close()
+        os.unlink(path)
+
+def request(path, req):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(path)
+    try:
+        send(conn, req)
+        return receive(conn)
+    finally:
+        conn.close()
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "Ss:M:ikh")
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+        sys.exit(-1)
+
+    server = False
+    path = default_socket()
+    budget = 1024
+    command = 'run'
+
+    for o, a in opts:
+        if o == '-S':
+            server = True
+        elif o == '-s':
+            path = a
+        elif o == '-M':
+            budget = int(a)
+        elif o == '-i':
+            command = 'stats'
+        elif o == '-k':
+            command = 'stop'
+        elif o == '-h':
+            usage()
+            sys.exit(0)
+        else:
+            assert False, "unhandled option"
+
+    if server:
+        serve(path, budget << 20)
+        return
+
+    if command == 'run' and len(args) < 1:
+        usage()
+        sys.exit(-1)
+
+    try:
+        resp = request(path, { 'command': command, 'script': args[0] if args else None,
+                               'argv': args[1:], 'cwd': os.getcwd() })
+    except socket.error as err:
+        print("failed to connect to server on {}: {}".format(path, err))
+        sys.exit(-1)
+
+    if command == 'stats':
+        s = resp['stats']
+        print("{} entries, {:.1f} of {:.1f} MB used, {} hits, {} misses".format(
+            s['entries'], s['size'] / 1e6, s['budget'] / 1e6, s['hits'], s['misses']))
+    elif 'output' in resp:
+        sys.stdout.write(resp['output'])
+    sys.exit(resp['status'])
+
+if __name__ == '__main__':
+    main()
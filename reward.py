@@ -4,8 +4,8 @@
 import getopt
 import os, sys
 import numpy as np
-import matplotlib.pyplot as plt
-from utils import import_params
+from collections import Counter
+from utils import import_params, count_rows, read_chunks, cumulative_reward, fit_time_steps, run_batch, tail_log, append_rows, refresh, decimate, pixel_width, use_headless, output_path, PROFILE_OPTS, profile_option, stage
 
 def usage():
     print("""usage: {} [OPTION...] DIRECTORY...
@@ -17,76 +17,138 @@ options:
   -c          show histogram with count of positive and negative rewards
   -t N,M      only show cummulative reward between time steps N and M
   -T          show experiment path in figure title
+  -f SECS     follow mode, keep reading data appended to reward.log and
+              refresh the plot every SECS seconds (-c and -t are ignored,
+              with -q the PDF is rewritten instead)
+  -j JOBS     process JOBS directories in parallel (implies -q)
   -q          quiet mode, don't show plot, only write PDF
+  --profile   print time and peak memory of each processing stage on exit
+  --profile-json=FILE
+              write time and peak memory of each processing stage as JSON
+              to FILE
+  --profile-dump=FILE
+              write cProfile statistics of the slowest stage to FILE
   -h          show this help and exit
 """.format(os.path.basename(sys.argv[0])))
 
-def fit_to_range(x, T):
-    # use negative indices as in python
-    if x < 0:
-        x = T + x
+def reward_blocks(fname, hrange, hists, stop=None):
+    # strip time from each block of the reward log and count the reward
+    # values within hrange on the fly for the histograms
+    start = 0
+    for chunk in read_chunks(fname, stop=stop):
+        rewards = chunk[:,1:]
+        n, N = rewards.shape
+        while len(hists) < N:
+            hists.append(Counter())
 
-    if x < 0:
-        x = 0
-    elif x >= T:
-        x = T - 1
+        lo, hi = max(hrange[0] - start, 0), max(hrange[1] - start, 0)
+        for i in range(N):
+            values, counts = np.unique(rewards[lo:hi,i], return_counts=True)
+            hists[i].update(dict(zip(values, counts)))
 
-    return x
+        start += n
+        yield rewards
 
-def reward(ddir, ts, do_count, quiet, show_title):
-    rewards = np.genfromtxt(os.path.join(ddir, 'reward.log'), delimiter=',')
+def reward_follow(ddir, interval, quiet, show_title):
+    import matplotlib.pyplot as plt
 
-    time = rewards[:,0]
-    rewards = rewards[:,1:]
-    T,N = rewards.shape
-    a,b = 0, T
-
-    if len(ts) == 2:
-        a,b = ts
-
-        a = fit_to_range(a, T)
-        b = fit_to_range(b, T)
-
-        t = range(a, b + 1)
-        T = len(t)
-    else:
-        t = range(T)
-
-    r = np.zeros((T,N))
+    log = tail_log(os.path.join(ddir, 'reward.log'))
+    total = None
+    r, T = None, 0
 
     fig = plt.figure()
+    ax = fig.add_subplot(111)
+    if show_title:
+        fig.suptitle(ddir)
 
-    for _t in t:
+    pdf = output_path(ddir, 'reward.pdf') if quiet else None
+    for _ in refresh(fig, interval, pdf):
+        # only the newly appended lines are parsed, the cumulative reward is
+        # continued from the running total
+        rows = next(log)
+        if len(rows) == 0:
+            continue
+        rewards = rows[:,1:]
+        N = rewards.shape[1]
+
+        if total is None:
+            total = np.zeros(N)
+            p = ax.plot(np.zeros((0, N)))
+            ax.legend(p, [ "reward #{}".format(n) for n in range(N) ],
+                    bbox_to_anchor=(0.5, 1.05), loc='center', borderaxespad=0., ncol=N)
+
+        c = np.cumsum(rewards, axis=0)
+        c += total - rewards
+        total += rewards.sum(axis=0)
+        r, T = append_rows(r, T, c)
+
+        # don't draw more points than there are pixels
+        td, rd = decimate(np.arange(T), r[:T], pixel_width(ax, fig.dpi))
         for n in range(N):
-            r[_t - a,n] = rewards[0:_t,n].sum(axis=0)
+            p[n].set_data(td[:,n], rd[:,n])
+        ax.relim()
+        ax.autoscale_view()
+
+def reward(ddir, ts, do_count, quiet, show_title, follow=None):
+    if follow is not None:
+        reward_follow(ddir, follow, quiet, show_title)
+        return
+
+    fname = os.path.join(ddir, 'reward.log')
+    # the rewards are summed up while parsing
+    with stage('parse'):
+        T = count_rows(fname)
+
+        # the histograms use the time range as a python slice
+        if len(ts) == 2:
+            hrange = slice(ts[0], ts[1]).indices(T)[:2]
+        else:
+            hrange = (0, T)
 
-    if do_count:
-        s = '1' + str(1 + N)
-    else:
-        s = '11'
+        # rows after the shown time range and the histogram range are not
+        # needed at all
+        stop = max(fit_time_steps(ts, T)[-1] + 1 if len(ts) == 2 else T, hrange[1])
 
-    ax1 = fig.add_subplot(int(s + '1'))
-    p = plt.plot(t, r)
-    ax1.legend(p, [ "reward #{}".format(n) for n in range(N) ],
-            bbox_to_anchor=(0.5, 1.05), loc='center', borderaxespad=0., ncol=N)
+        hists = []
+        t, r = cumulative_reward(reward_blocks(fname, hrange, hists, stop), ts, T)
+        N = len(hists)
 
-    if do_count:
-        for n in range(N):
-            ax = fig.add_subplot(int(s + str(n)))
-            if len(ts) == 2:
-                plt.hist(rewards[ts[0]:ts[1],n], bins=2)
-            else:
-                plt.hist(rewards[:,n], bins=2)
+    with stage('render'):
+        import matplotlib.pyplot as plt
+        fig = plt.figure()
 
-    if show_title:
-        fig.suptitle(ddir)
-    plt.savefig(os.path.join(ddir, 'reward.pdf'), dpi=300, bbox_inches='tight', pad_inches=0.15)
+        if do_count:
+            s = '1' + str(1 + N)
+        else:
+            s = '11'
+
+        ax1 = fig.add_subplot(int(s + '1'))
+        # don't draw more points than there are pixels in the PDF
+        td, rd = decimate(t, r, pixel_width(ax1, 300))
+        p = plt.plot(td, rd)
+        ax1.legend(p, [ "reward #{}".format(n) for n in range(N) ],
+                bbox_to_anchor=(0.5, 1.05), loc='center', borderaxespad=0., ncol=N)
+
+        if do_count:
+            for n in range(N):
+                ax = fig.add_subplot(int(s + str(n + 2)))
+                values, counts = zip(*sorted(hists[n].items()))
+                plt.hist(values, bins=2, weights=counts)
+
+        if show_title:
+            fig.suptitle(ddir)
+
+    with stage('save'):
+        plt.savefig(output_path(ddir, 'reward.pdf'), dpi=300, bbox_inches='tight', pad_inches=0.15)
     if not quiet:
         plt.show()
 
+# short options of main(), also checked by plotd.py
+OPTIONS = "cf:t:Tqhj:"
+
 def main():
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "ct:Tqh")
+        opts, args = getopt.getopt(sys.argv[1:], OPTIONS, PROFILE_OPTS)
     except getopt.GetoptError, err:
         print(str(err))
         usage()
@@ -99,6 +161,8 @@ def main():
     do_count = False
     show_title = False
     quiet = False
+    jobs = 1
+    follow = None
     ts = []
 
     for o, a in opts:
@@ -111,16 +175,28 @@ def main():
                 sys.exit(-1)
         elif o == '-T':
             show_title = True
+        elif o == '-f':
+            follow = float(a)
+        elif o == '-j':
+            jobs = int(a)
         elif o == '-q':
             quiet = True
         elif o == '-h':
             usage()
             sys.exit(0)
+        elif o.startswith('--profile'):
+            profile_option(o, a)
         else:
             assert False, "unhandled option"
 
-    for arg in args:
-        reward(arg, np.array(ts, np.int32), do_count, quiet, show_title)
+    if jobs > 1:
+        quiet = True
+    if quiet:
+        use_headless()
+
+    if run_batch(reward, args, (np.array(ts, np.int32), do_count, quiet, show_title),
+                 { 'follow': follow }, jobs) > 0:
+        sys.exit(-1)
 
 if __name__ == '__main__':
     main()
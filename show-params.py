@@ -7,7 +7,8 @@
 
 import getopt
 import os, sys
-from utils import import_params
+from utils import import_params, is_archive, ARCHIVE_EXT
+from params_index import open_index, indexed, update_index, query_index, get_params
 
 LEARNING_RULES = {
         0: 'Oja',
@@ -30,29 +31,88 @@ REWARD_QTY = {
 }
 
 def usage():
-    print("""usage: {} [OPTION...] DIRECTORY...
+    print("""usage: {} [OPTION...] DIRECTORY|ARCHIVE...
 
-Show drobot experiment parameters in human-readable form for chosen directories.
+Show drobot experiment parameters in human-readable form for chosen directories
+or experiment archives (see pack.py).
 
 options:
 
-  -R  recursive mode
-  -h  show this help and exit""".format(os.path.basename(sys.argv[0])))
+  -R                 recursive mode, include all experiment directories and
+                     archives below DIRECTORY
+  -I FILE            query the index of all experiments in FILE (implies -R),
+                     the tree is only scanned if it isn't indexed yet
+  -U                 update the index given by -I before querying it, only
+                     directories which changed since the last update are
+                     scanned again
+  -w NAME=VALUE      only show experiments with parameter NAME set to VALUE,
+                     may be given multiple times (e.g. -w learningRule=Oja)
+  -l                 only list the matching experiment directories
+  -h                 show this help and exit""".format(os.path.basename(sys.argv[0])))
+
+NAMED_PARAMS = {
+        'learningRule': LEARNING_RULES,
+        'activationFn': ACTIVATION_FUNCTIONS,
+        'rewardQty': REWARD_QTY,
+}
+
+def parse_condition(a):
+    l, _, v = a.partition('=')
+    if len(l) == 0 or len(v) == 0:
+        return None
+
+    # allow human-readable names for enumerated parameters
+    for n, name in NAMED_PARAMS.get(l, {}).items():
+        if name.lower() == v.lower():
+            v = str(n)
+            break
+
+    return l, v
+
+def matches(params, conditions):
+    for l, v in conditions:
+        if l not in params:
+            return False
+        try:
+            if float(params[l]) != float(v):
+                return False
+        except ValueError:
+            if params[l] != v:
+                return False
+
+    return True
+
+def show_index(d, params_file, index, conditions, list_only, update=False):
+    db = open_index(index)
+    if update or not indexed(db, d):
+        update_index(db, d, params_file)
+    for path in query_index(db, d, conditions):
+        if list_only:
+            print(path)
+        else:
+            print_params(path, get_params(db, path))
+    db.close()
 
-def show_params(d, params_file, recursive):
-    if not os.path.isdir(d):
+def show_params(d, params_file, recursive, conditions=(), list_only=False):
+    if not os.path.isdir(d) and not is_archive(d):
         return
 
-    if recursive:
+    if recursive and os.path.isdir(d):
         for dd in os.listdir(d):
             dd = os.path.join(d, dd)
-            if os.path.isdir(dd):
-                show_params(dd, params_file, recursive)
+            if os.path.isdir(dd) or (dd.endswith(ARCHIVE_EXT) and is_archive(dd)):
+                show_params(dd, params_file, recursive, conditions, list_only)
 
     params = import_params(d, params_file, verbose=False)
-    if not params:
+    if not params or not matches(params, conditions):
         return
 
+    if list_only:
+        print(d)
+    else:
+        print_params(d, params)
+
+def print_params(d, params):
     print("experiment {}".format(d))
     linear = False
     for l, v in params.items():
@@ -79,7 +139,7 @@ def show_params(d, params_file, recursive):
 
 def main():
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "Rh")
+        opts, args = getopt.getopt(sys.argv[1:], "RI:Uw:lh")
     except getopt.GetoptError, err:
         print(str(err))
         usage()
@@ -91,10 +151,26 @@ def main():
 
     recursive = False
     params_file = 'params.log'
+    index = None
+    update = False
+    conditions = []
+    list_only = False
 
     for o, a in opts:
         if o == '-R':
             recursive = True
+        elif o == '-I':
+            index = a
+        elif o == '-U':
+            update = True
+        elif o == '-w':
+            c = parse_condition(a)
+            if c is None:
+                print("invalid parameter condition: {}".format(a))
+                sys.exit(-1)
+            conditions.append(c)
+        elif o == '-l':
+            list_only = True
         elif o == '-h':
             usage()
             sys.exit(0)
@@ -102,7 +178,10 @@ def main():
             assert False, "unhandled option"
 
     for d in args:
-        show_params(d, params_file, recursive)
+        if index is not None:
+            show_index(d, params_file, index, conditions, list_only, update)
+        else:
+            show_params(d, params_file, recursive, conditions, list_only)
 
 if __name__ == '__main__':
     main()
@@ -7,23 +7,40 @@
 import os
 import fnmatch
 import re
+import itertools
+import multiprocessing
+import threading
+import time
+import timeit
+import atexit
+import json
+import sys
+import cProfile
+import functools
+import zipfile
+import zlib
+import io
 import numpy as np
-import matplotlib.pyplot as plt
 from collections import OrderedDict
+from contextlib import contextmanager
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
 def import_params(ddir, pfile='params.log', verbose=True):
-    if not os.path.isdir(ddir):
+    if not os.path.isdir(ddir) and not is_archive(ddir):
         if verbose:
-            print("{} is not a directory".format(ddir))
+            print("{} is neither a directory nor an experiment archive".format(ddir))
         return None
 
     p = os.path.join(ddir, pfile)
-    if not os.path.isfile(p):
+    if not log_exists(p):
         if verbose:
             print("parameter file {} not found".format(p))
         return None
 
-    f = open(p, 'r')
+    f = open_log(p)
     labels = f.readline().strip().split(',')
     values = f.readline().strip().split(',')
     f.close()
@@ -41,10 +58,389 @@ def import_params(ddir, pfile='params.log', verbose=True):
     # put parameters into a directory, accessable by parameter name
     return OrderedDict(zip(labels, values))
 
-def get_weights(ddir, nInputs, nOutputs, verbose=True):
-    files = os.listdir(ddir)
-    xfiles = fnmatch.filter(files, 'weights_x_in*.log')
-    yfiles = fnmatch.filter(files, 'weights_y_in*.log')
+# default number of rows per block when reading logs chunk-wise
+CHUNK_ROWS = 65536
+
+# name prefix of the binary weight cache written next to the weight logs
+WEIGHTS_CACHE = 'weights_cache'
+
+# suffix of the line offset index written next to a log, see line_index().
+# The offsets are preceded by a header of LINE_INDEX_HEADER values: a magic
+# number, the inode of the log and checksums of its first and last line.
+LINE_INDEX = '.idx'
+LINE_INDEX_MAGIC = 0x6c696478
+LINE_INDEX_HEADER = 4
+
+def parse_csv(data, delimiter=',', dtype=np.float64):
+    # fast parser for the drobot logs, which have a fixed number of columns
+    # and no missing values: let numpy's C tokenizer parse all values at once
+    # and reshape according to the number of columns in the first line
+    data = data.strip()
+    if len(data) == 0:
+        return np.zeros((0, 0), dtype=dtype)
+
+    delimiter = delimiter.encode() if isinstance(data, bytes) else delimiter
+    newline = b'\n' if isinstance(data, bytes) else '\n'
+    end = data.find(newline)
+    ncols = (data if end < 0 else data[:end]).count(delimiter) + 1
+
+    # integer values may still be written as floats, parse as float first
+    ptype = dtype if np.issubdtype(dtype, np.floating) else np.float64
+    values = np.fromstring(data.replace(newline, delimiter), dtype=ptype, sep=delimiter)
+    # fromstring silently stops at the first value it can't parse, so every
+    # line must have been parsed completely
+    nrows = data.count(newline) + 1
+    if values.size != nrows * ncols:
+        raise ValueError("invalid value or inconsistent number of columns, expected {} rows of {} values".format(nrows, ncols))
+
+    return values.reshape(-1, ncols).astype(dtype, copy=False)
+
+def load_csv(fname, delimiter=',', dtype=np.float64):
+    a = _archive_member(fname)
+    if a is not None:
+        return _archive_rows(a[0], a[1], dtype=dtype)
+
+    f = open(fname, 'rb')
+    data = f.read()
+    f.close()
+
+    return parse_csv(data, delimiter, dtype)
+
+# in-process cache of parsed logs, see enable_memory_cache()
+_memcache = None
+
+def enable_memory_cache(budget):
+    # keep parsed logs in memory for later calls in the same process, e.g. in
+    # the plotd.py server. Entries are dropped as soon as the files they were
+    # read from change and the least recently used ones are evicted once the
+    # total size exceeds budget bytes.
+    global _memcache
+    _memcache = {
+        'entries': OrderedDict(),
+        'budget': budget,
+        'size': 0,
+        'hits': 0,
+        'misses': 0,
+    }
+
+def memory_cache_stats():
+    c = _memcache
+    if c is None:
+        return None
+    return OrderedDict([
+        ('entries', len(c['entries'])),
+        ('size', c['size']),
+        ('budget', c['budget']),
+        ('hits', c['hits']),
+        ('misses', c['misses']),
+    ])
+
+def _file_key(fname):
+    # logs in an archive change together with the archive
+    a = _archive_member(fname)
+    st = os.stat(a[0]['path'] if a is not None else fname)
+    return st.st_size, st.st_mtime
+
+def _memcache_get(key, validator):
+    c = _memcache
+    if c is None:
+        return None
+
+    e = c['entries'].pop(key, None)
+    if e is None or e[0] != validator:
+        if e is not None:
+            c['size'] -= e[2]
+        c['misses'] += 1
+        return None
+
+    # re-insert as most recently used
+    c['entries'][key] = e
+    c['hits'] += 1
+    return e[1]
+
+def _memcache_put(key, validator, value, nbytes):
+    c = _memcache
+    if c is None or nbytes > c['budget']:
+        return
+
+    old = c['entries'].pop(key, None)
+    if old is not None:
+        c['size'] -= old[2]
+    c['entries'][key] = (validator, value, nbytes)
+    c['size'] += nbytes
+
+    while c['size'] > c['budget']:
+        _, e = c['entries'].popitem(last=False)
+        c['size'] -= e[2]
+
+# experiment archives written by pack.py: a zip file with params.log, the
+# manifest and every other log parsed and split into chunks of chunk_rows
+# rows. Since version 2 each chunk is stored as member <log>/<chunk>.dz
+# encoded by encode_chunk(), version 1 used compressed .npy members.
+ARCHIVE_EXT = '.zip'
+ARCHIVE_MANIFEST = 'manifest.json'
+ARCHIVE_VERSION = 2
+# default number of rows per chunk in archives, smaller than CHUNK_ROWS so
+# reading a few time steps only needs to decompress little data
+ARCHIVE_CHUNK_ROWS = 4096
+
+# archives opened by this process, see _open_archive()
+_archives = {}
+
+def is_archive(path):
+    if not os.path.isfile(path):
+        return False
+    try:
+        _open_archive(path)
+    except (ValueError, IOError, zipfile.BadZipfile):
+        return False
+    return True
+
+def _open_archive(path):
+    # archives are kept open as long as they don't change. Processes forked
+    # from this one reopen them, the file position can't be shared.
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    a = _archives.get(path)
+    if a is not None and a['key'] == (st.st_size, st.st_mtime) and a['pid'] == os.getpid():
+        return a
+
+    z = zipfile.ZipFile(path, 'r', allowZip64=True)
+    try:
+        manifest = json.loads(z.read(ARCHIVE_MANIFEST).decode('utf-8'))
+    except (KeyError, ValueError):
+        z.close()
+        raise ValueError("{} is not an experiment archive".format(path))
+    if manifest.get('version') not in (1, ARCHIVE_VERSION):
+        z.close()
+        raise ValueError("unsupported archive version in {}".format(path))
+
+    a = { 'path': path, 'zip': z, 'manifest': manifest, 'key': (st.st_size, st.st_mtime), 'pid': os.getpid() }
+    _archives[path] = a
+    return a
+
+def archive_manifest(path):
+    return _open_archive(path)['manifest']
+
+def _archive_member(fname):
+    # returns the archive and the name of the log if fname refers to a log
+    # inside an archive, i.e. is of the form ARCHIVE/NAME
+    d, name = os.path.split(fname)
+    if d == '' or os.path.isdir(d) or not is_archive(d):
+        return None
+    return _open_archive(d), name
+
+def _archive_log(a, name):
+    try:
+        return a['manifest']['logs'][name]
+    except KeyError:
+        raise IOError("no log {} in archive {}".format(name, a['path']))
+
+def encode_chunk(chunk, level=6):
+    # lossless encoding of a block of rows of a log: every column is delta
+    # encoded along time on the integer representation of its values, so
+    # floats are restored bit by bit. Slowly changing values leave only the
+    # low order bytes of the deltas set (negative ones as well after zigzag
+    # encoding), grouping the bytes by significance gives zlib long runs of
+    # zeros to compress.
+    x = np.ascontiguousarray(chunk.T, dtype='<f8' if np.issubdtype(chunk.dtype, np.floating) else '<i8')
+    x = x.view('<i8')
+    d = x.copy()
+    d[:,1:] -= x[:,:-1]
+    z = (d << 1) ^ (d >> 63)
+    return zlib.compress(z.view(np.uint8).reshape(-1, 8).T.tobytes(), level)
+
+def decode_chunk(data, rows, cols, dtype):
+    b = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(8, -1)
+    z = np.ascontiguousarray(b.T).view('<u8').reshape(cols, rows)
+    d = (z >> np.uint64(1)).view('<i8') ^ -(z & np.uint64(1)).view('<i8')
+    x = np.cumsum(d, axis=1, dtype='<i8')
+    x = x.view('<f8' if np.issubdtype(np.dtype(dtype), np.floating) else '<i8')
+    return np.ascontiguousarray(x.T, dtype=dtype)
+
+def _archive_chunk(a, name, k):
+    if a['manifest']['version'] == 1:
+        data = a['zip'].read('{}/{}.npy'.format(name, k))
+        return np.load(io.BytesIO(data))
+
+    log = _archive_log(a, name)
+    n = a['manifest']['chunk_rows']
+    data = a['zip'].read('{}/{}.dz'.format(name, k))
+    return decode_chunk(data, min(n, log['rows'] - k * n), log['cols'], log['dtype'])
+
+def _archive_chunks(a, name, start=0, stop=None):
+    # yield the rows start:stop of a log, only the chunks covering them are
+    # read and decompressed
+    log = _archive_log(a, name)
+    n = a['manifest']['chunk_rows']
+    stop = log['rows'] if stop is None else min(stop, log['rows'])
+    for k in range(start // n, (stop + n - 1) // n):
+        chunk = _archive_chunk(a, name, k)
+        yield chunk[max(start - k * n, 0):stop - k * n]
+
+def _archive_rows(a, name, ts=None, dtype=np.float64):
+    # all rows of a log or the ones with the given (non-negative) indices
+    log = _archive_log(a, name)
+    if log['rows'] == 0:
+        return np.zeros((0, 0), dtype=dtype)
+    if ts is None:
+        return np.concatenate(list(_archive_chunks(a, name))).astype(dtype, copy=False)
+
+    n = a['manifest']['chunk_rows']
+    rows = np.empty((len(ts), log['cols']), dtype=dtype)
+    for k in np.unique(ts // n):
+        sel = np.flatnonzero(ts // n == k)
+        rows[sel] = _archive_chunk(a, name, k)[ts[sel] - k * n]
+    return rows
+
+def log_exists(fname):
+    a = _archive_member(fname)
+    if a is not None:
+        return a[1] in a[0]['manifest']['logs'] or a[1] in a[0]['manifest']['files']
+    return os.path.isfile(fname)
+
+def list_logs(ddir, pattern='*'):
+    if is_archive(ddir):
+        m = _open_archive(ddir)['manifest']
+        return fnmatch.filter(list(m['logs']) + m['files'], pattern)
+    return fnmatch.filter(os.listdir(ddir), pattern)
+
+def open_log(fname):
+    # text file object of a log, which may be inside an archive
+    a = _archive_member(fname)
+    if a is None:
+        return open(fname, 'r')
+
+    a, name = a
+    if name in a['manifest']['files']:
+        data = a['zip'].read(name)
+        return io.StringIO(data.decode('utf-8'))
+
+    # parsed logs are formatted again as they were written
+    log = _archive_log(a, name)
+    f = io.BytesIO()
+    for chunk in _archive_chunks(a, name):
+        np.savetxt(f, chunk, fmt=log['fmt'], delimiter=',')
+    return io.StringIO(f.getvalue().decode('utf-8'))
+
+def output_path(ddir, fname):
+    # files created for an experiment are written into its directory and
+    # next to an archive, prefixed with the archive's name
+    if is_archive(ddir) and not os.path.isabs(fname):
+        return os.path.splitext(ddir)[0] + '_' + fname
+    return os.path.join(ddir, fname)
+
+def _weight_files(ddir, axis):
+    return list_logs(ddir, 'weights_{}_in*.log'.format(axis))
+
+def _weights_cache_prefix(ddir, dtype):
+    # there is one cache per dtype, so callers using different dtypes don't
+    # invalidate each other's cache
+    return os.path.join(ddir, '{}_{}'.format(WEIGHTS_CACHE, np.dtype(dtype).name))
+
+def _weights_cache_key(ddir, files):
+    # the cache is only valid as long as none of the weight logs changed
+    if is_archive(ddir):
+        return [ "{},{},{!r}".format(os.path.basename(ddir), *_file_key(ddir)) ]
+    key = []
+    for f in sorted(files):
+        st = os.stat(os.path.join(ddir, f))
+        key.append("{},{},{!r}".format(f, st.st_size, st.st_mtime))
+    return key
+
+def _load_weights_cache(prefix, key):
+    kfile = prefix + '.key'
+    if not os.path.isfile(kfile):
+        return None
+
+    f = open(kfile, 'r')
+    cached = [ l.strip() for l in f.readlines() ]
+    f.close()
+
+    if cached != key:
+        return None
+
+    try:
+        W = [ np.load(prefix + '_{}.npy'.format(a), mmap_mode='r')
+                for a in ('t', 'x', 'y') ]
+    except (IOError, ValueError):
+        return None
+
+    return tuple(W)
+
+def _save_weights_cache(prefix, key, time, Wx, Wy, verbose=True):
+    kfile = prefix + '.key'
+    try:
+        # invalidate the old cache first, the key is written last so a
+        # partially written cache is never picked up
+        if os.path.isfile(kfile):
+            os.remove(kfile)
+        for a, W in (('t', time), ('x', Wx), ('y', Wy)):
+            p = prefix + '_{}.npy'.format(a)
+            f = open(p + '.tmp', 'wb')
+            np.save(f, W)
+            f.close()
+            os.rename(p + '.tmp', p)
+        f = open(kfile, 'w')
+        f.write('\n'.join(key) + '\n')
+        f.close()
+    except (IOError, OSError) as err:
+        if verbose:
+            print("failed to write weight cache {}: {}".format(prefix, err))
+
+def _parse_weights(task):
+    axis, n, fname, ts = task
+    return axis, n, load_csv(fname) if ts is None else read_rows(fname, ts)
+
+def _read_weights(ddir, xfiles, yfiles, dtype=np.float64, workers=1, ts=None):
+    # files don't necessarily get listed in numerically correct order, thus
+    # extract index number from the file name
+    tasks = []
+    for axis, files in (('x', xfiles), ('y', yfiles)):
+        pattern = re.compile('weights_{}_in_(\d+).*\.log'.format(axis))
+        for fname in files:
+            n = int(pattern.match(fname).group(1))
+            tasks.append((axis, n, os.path.join(ddir, fname), ts))
+
+    # worker processes of a batch (which are daemonic) can't start a pool
+    # of their own, parse sequentially there
+    pool = None
+    if workers > 1 and not multiprocessing.current_process().daemon:
+        pool = multiprocessing.Pool(processes=workers)
+        results = pool.imap_unordered(_parse_weights, tasks)
+    else:
+        results = (_parse_weights(task) for task in tasks)
+
+    time = None
+    W = { 'x': None, 'y': None }
+    try:
+        for axis, n, w in results:
+            # use size of the first parsed file for array preallocation, the
+            # first column (time) is stored only once
+            if time is None:
+                time = w[:,0].copy()
+            if W[axis] is None:
+                nfiles = len(xfiles) if axis == 'x' else len(yfiles)
+                W[axis] = np.zeros([w.shape[0], w.shape[1] - 1, nfiles], dtype=dtype)
+            if w.shape[0] != len(time) or w.shape[1] - 1 != W[axis].shape[1]:
+                raise ValueError("inconsistent size of weight file weights_{}_in_{}.log".format(axis, n))
+            W[axis][:,:, n] = w[:,1:]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return time, W['x'], W['y']
+
+def get_weights_compact(ddir, nInputs, nOutputs, dtype=np.float64, verbose=True, cache=True, workers=1, ts=None):
+    # returns the time steps as a 1-D array of length T and the weights as
+    # arrays of shape (T, nOutputs, nInputs) in the given dtype. If a list of
+    # time step indices ts is given, only these time steps are returned.
+    if ts is not None:
+        return get_weights_at(ddir, nInputs, nOutputs, ts, dtype, verbose, workers)
+
+    xfiles = _weight_files(ddir, 'x')
+    yfiles = _weight_files(ddir, 'y')
     nx = len(xfiles)
     ny = len(yfiles)
 
@@ -54,45 +450,834 @@ def get_weights(ddir, nInputs, nOutputs, verbose=True):
                      should be {} (nInputs), but only {}/{} (x/y) found""".format(nInputs, nx, ny))
         return
 
-    # determine size of files for array preallocation
-    sx = np.genfromtxt(os.path.join(ddir, xfiles[0]), delimiter=',').shape
-    sy = np.genfromtxt(os.path.join(ddir, yfiles[0]), delimiter=',').shape
+    # archives are read fast enough to not need the cache
+    if is_archive(ddir):
+        cache = False
 
-    # the first column is time
-    if sx[1] - 1 != sy[1] - 1 != nOutputs:
+    if cache or _memcache is not None:
+        key = _weights_cache_key(ddir, xfiles + yfiles)
+        mkey = ('weights', os.path.abspath(ddir), np.dtype(dtype).name)
+        W = _memcache_get(mkey, key)
+        if W is not None and W[1].shape[1] == W[2].shape[1] == nOutputs:
+            return W
+
+    if cache:
+        prefix = _weights_cache_prefix(ddir, dtype)
+        W = _load_weights_cache(prefix, key)
+        if W is not None and W[1].shape[1] == W[2].shape[1] == nOutputs:
+            _memcache_put(mkey, key, W, sum(w.nbytes for w in W))
+            return W
+
+    # parse the weight files using a pool of processes if workers > 1
+    try:
+        time, Wx, Wy = _read_weights(ddir, xfiles, yfiles, dtype, workers)
+    except ValueError as err:
+        if verbose:
+            print(str(err))
+        return
+
+    if Wx.shape[1] != nOutputs or Wy.shape[1] != nOutputs:
         if verbose:
             print("""invalid number of outputs in weight files""")
         return
 
-    Wx = np.zeros([sx[0], nOutputs + 1, nx])
-    Wy = np.zeros([sy[0], nOutputs + 1, ny])
+    if cache:
+        _save_weights_cache(prefix, key, time, Wx, Wy, verbose)
+    if _memcache is not None:
+        # cached arrays are shared between callers
+        for w in (time, Wx, Wy):
+            w.flags.writeable = False
+        _memcache_put(mkey, key, (time, Wx, Wy), time.nbytes + Wx.nbytes + Wy.nbytes)
 
-    # files don't necessarily get listed in numerically correct order, thus
-    # extract index number from the file name
-    pattern = re.compile('weights_x_in_(\d+).*\.log')
-    for i in range(nx):
-        n = int(pattern.match(xfiles[i]).group(1))
-        Wx[:,:, n] = np.genfromtxt(os.path.join(ddir, xfiles[i]), delimiter=',')
-
-    pattern = re.compile('weights_y_in_(\d+).*\.log')
-    for i in range(ny):
-        n = int(pattern.match(yfiles[i]).group(1))
-        Wy[:,:, n] = np.genfromtxt(os.path.join(ddir, yfiles[i]), delimiter=',')
-
-    return Wx, Wy
-
-def save_weights_all(ddir, Wx, Wy, fmt='%1.12f', delim=',', verbose=True):
-    np.savetxt(os.path.join(ddir, "weights_all_x.log"), Wx, fmt=fmt, delimiter=delim)
-    if verbose:
-        print("Weight file for x-axis written to {}".format(os.path.join(ddir, 'weights_all_x.log')))
-    np.savetxt(os.path.join(ddir, "weights_all_y.log"), Wy, fmt=fmt, delimiter=delim)
-    if verbose:
-        print("Weight file for y-axis written to {}".format(os.path.join(ddir, 'weights_all_x.log')))
+    return time, Wx, Wy
+
+def get_weights(ddir, nInputs, nOutputs, verbose=True, cache=True, workers=1, ts=None):
+    W = get_weights_compact(ddir, nInputs, nOutputs, np.float64, verbose, cache, workers, ts)
+    if W is None:
+        return
+
+    # put the time back into the first column of every input
+    time, Wx, Wy = W
+    T = len(time)
+    Wxt = np.empty([T, nOutputs + 1, nInputs])
+    Wyt = np.empty([T, nOutputs + 1, nInputs])
+    Wxt[:,0,:] = Wyt[:,0,:] = time.reshape(-1, 1)
+    Wxt[:,1:,:] = Wx
+    Wyt[:,1:,:] = Wy
+
+    return Wxt, Wyt
+
+def get_weights_at(ddir, nInputs, nOutputs, ts, dtype=np.float64, verbose=True, workers=1):
+    # like get_weights_compact, but only for the time step indices in ts
+    # (negative ones count from the end). Unless the logs are cached already
+    # only the requested rows are read, using the line index of every log.
+    xfiles = _weight_files(ddir, 'x')
+    yfiles = _weight_files(ddir, 'y')
+    nx = len(xfiles)
+    ny = len(yfiles)
+
+    if nx == 0 or ny == 0 or nx != ny or nx != nInputs:
+        if verbose:
+            print("""not enough weight files in your data directory,
+                     should be {} (nInputs), but only {}/{} (x/y) found""".format(nInputs, nx, ny))
+        return
+
+    # indexing the memory mapped cache only reads the requested rows
+    key = _weights_cache_key(ddir, xfiles + yfiles)
+    W = _memcache_get(('weights', os.path.abspath(ddir), np.dtype(dtype).name), key)
+    if W is None and not is_archive(ddir):
+        W = _load_weights_cache(_weights_cache_prefix(ddir, dtype), key)
+    if W is not None and W[1].shape[1] == W[2].shape[1] == nOutputs:
+        ts = fit_time_steps(ts, len(W[0]))
+        return tuple(np.array(w[ts]) for w in W)
+
+    ts = fit_time_steps(ts, weight_steps(ddir))
+    try:
+        time, Wx, Wy = _read_weights(ddir, xfiles, yfiles, dtype, workers, ts)
+    except ValueError as err:
+        if verbose:
+            print(str(err))
+        return
+
+    if Wx.shape[1] != nOutputs or Wy.shape[1] != nOutputs:
+        if verbose:
+            print("""invalid number of outputs in weight files""")
+        return
+
+    return time, Wx, Wy
+
+def weight_steps(ddir):
+    # number of time steps in the weight logs, without parsing them
+    fname = os.path.join(ddir, 'weights_x_in_0.log')
+    if is_archive(ddir):
+        return count_rows(fname)
+    return len(line_index(fname)) - 1
+
+# file formats save_weights_all() can write
+WEIGHTS_ALL_FORMATS = [ 'log', 'npy', 'bin' ]
+
+def save_weights_all(ddir, Wx, Wy, fmt='%1.12f', delim=',', verbose=True, ext='log'):
+    # write one row per time step to weights_all_x/y.EXT, either as text
+    # (log), as numpy array (npy) or as raw little-endian doubles (bin)
+    for axis, W in (('x', Wx), ('y', Wy)):
+        fname = output_path(ddir, "weights_all_{}.{}".format(axis, ext))
+        if ext == 'log':
+            np.savetxt(fname, W, fmt=fmt, delimiter=delim)
+        elif ext == 'npy':
+            np.save(fname, np.asarray(W, dtype='<f8'))
+        elif ext == 'bin':
+            np.asarray(W, dtype='<f8').tofile(fname)
+        else:
+            raise ValueError("unknown weight file format: {}".format(ext))
+        if verbose:
+            print("Weight file for {}-axis written to {}".format(axis, fname))
 
 def get_cmap(cmap, default='gray_r'):
+    # matplotlib.cm doesn't pull in pyplot and a backend
+    from matplotlib import cm as colormaps
     try:
-        cm = plt.get_cmap(cmap)
+        cm = colormaps.get_cmap(cmap)
     except ValueError as e:
-        cm = plt.get_cmap(default)
+        cm = colormaps.get_cmap(default)
 
     return cm
+
+def pixel_width(ax, dpi):
+    # width of the axes in pixels when rendered at dpi
+    fig = ax.get_figure()
+    return int(ax.get_position().width * fig.get_figwidth() * dpi)
+
+def decimate(x, y, nbins):
+    # reduce the series y(x) to the minimum and maximum of each of nbins
+    # buckets of consecutive samples, kept in their original order, so peaks
+    # survive when there are more samples than pixels. y may be 2-D with one
+    # series per column, x and y are then returned as 2-D arrays of the same
+    # shape which can directly be passed to plot().
+    y = np.asarray(y)
+    squeeze = y.ndim == 1
+    if squeeze:
+        y = y.reshape(-1, 1)
+    T, N = y.shape
+
+    if T <= 2 * nbins:
+        x = np.repeat(np.asarray(x).reshape(-1, 1), N, axis=1)
+        return (x[:,0], y[:,0]) if squeeze else (x, y)
+
+    # pad the last bucket with the last sample
+    k = int(np.ceil(float(T) / nbins))
+    nb = int(np.ceil(float(T) / k))
+    if nb * k > T:
+        y = np.concatenate((y, np.repeat(y[-1:], nb * k - T, axis=0)))
+    yb = y.reshape(nb, k, N)
+
+    lo = np.argmin(yb, axis=1)
+    hi = np.argmax(yb, axis=1)
+    idx = np.stack((np.minimum(lo, hi), np.maximum(lo, hi)), axis=1)
+    idx = idx + (np.arange(nb) * k).reshape(-1, 1, 1)
+    idx = np.minimum(idx.reshape(2 * nb, N), T - 1)
+
+    xd = np.asarray(x)[idx]
+    yd = y[idx, np.arange(N)]
+
+    return (xd[:,0], yd[:,0]) if squeeze else (xd, yd)
+
+def movie_files(fname):
+    # name of the movie file or the pattern of the numbered PNG files
+    if fname.endswith('.png'):
+        return fname[:-len('.png')] + '_%06d.png'
+    return fname
+
+def movie_error(fname):
+    # why a movie can't be written to fname, None if it can
+    if fname.endswith('.png'):
+        return None
+    from matplotlib import animation
+    if not animation.writers.is_available('ffmpeg'):
+        return "ffmpeg not found, cannot write {}: install ffmpeg or give a movie name ending in .png to write the frames as PNG files".format(fname)
+    return None
+
+def write_frames(fig, fname, fps):
+    # generator writing the current state of fig as the next movie frame on
+    # every next() after the first one, which only sets up the writer.
+    # Frames are piped to ffmpeg as they are rendered or, if fname ends in
+    # .png, written to numbered PNG files. close() finishes the movie.
+    if fname.endswith('.png'):
+        pattern = movie_files(fname)
+        i = 0
+        while True:
+            yield
+            fig.savefig(pattern % i, dpi=fig.dpi)
+            i += 1
+    else:
+        from matplotlib import animation
+        err = movie_error(fname)
+        if err is not None:
+            raise IOError(err)
+        writer = animation.FFMpegWriter(fps=fps)
+        writer.setup(fig, fname, dpi=fig.dpi)
+        try:
+            while True:
+                yield
+                writer.grab_frame()
+        finally:
+            writer.finish()
+
+def use_headless():
+    # render without a display, e.g. in quiet mode or in worker processes.
+    # Choosing the backend before pyplot gets imported avoids loading a GUI
+    # toolkit at all.
+    if 'matplotlib.pyplot' in sys.modules:
+        sys.modules['matplotlib.pyplot'].switch_backend('Agg')
+    else:
+        import matplotlib
+        matplotlib.use('Agg')
+
+def _batch_worker(task):
+    fn, ddir, args, kwargs = task
+    try:
+        result = fn(ddir, *args, **kwargs)
+    except (Exception, SystemExit) as err:
+        return ddir, None, "{}: {}".format(type(err).__name__, err)
+    finally:
+        # matplotlib is only loaded by functions which draw something
+        if 'matplotlib.pyplot' in sys.modules:
+            sys.modules['matplotlib.pyplot'].close('all')
+
+    return ddir, result, None
+
+def map_batch(fn, dirs, args=(), kwargs=None, jobs=1):
+    # yield (ddir, result, error) of fn(ddir, *args, **kwargs) for every
+    # directory as soon as it is done, using a pool of jobs processes if
+    # jobs > 1. Failures are reported as error message and don't abort.
+    if kwargs is None:
+        kwargs = {}
+
+    tasks = [ (fn, ddir, args, kwargs) for ddir in dirs ]
+    # stages can only be profiled in this process
+    if _profile is not None:
+        jobs = 1
+    if jobs <= 1:
+        for task in tasks:
+            yield _batch_worker(task)
+        return
+
+    pool = multiprocessing.Pool(processes=jobs, initializer=use_headless)
+    try:
+        for r in pool.imap_unordered(_batch_worker, tasks):
+            yield r
+    finally:
+        pool.close()
+        pool.join()
+
+def run_batch(fn, dirs, args=(), kwargs=None, jobs=1, verbose=True):
+    # call fn(ddir, *args, **kwargs) for every directory, using a pool of
+    # jobs processes if jobs > 1. In that case failures are reported per
+    # directory and don't abort the batch. Returns the number of failures.
+    if jobs <= 1 or _profile is not None:
+        for ddir in dirs:
+            fn(ddir, *args, **(kwargs or {}))
+        return 0
+
+    failed = 0
+    for ddir, _, err in map_batch(fn, dirs, args, kwargs, jobs):
+        if err is not None:
+            failed += 1
+            if verbose:
+                print("{}: failed: {}".format(ddir, err))
+
+    if verbose and failed > 0:
+        print("{} of {} directories failed".format(failed, len(dirs)))
+
+    return failed
+
+# long options of all scripts to profile their processing stages, handled by
+# profile_option()
+PROFILE_OPTS = [ 'profile', 'profile-json=', 'profile-dump=' ]
+# interval in seconds at which the resident set size is sampled
+PROFILE_SAMPLE = 0.01
+
+_profile = None
+
+def _rss():
+    # current resident set size in bytes, 0 if unknown
+    try:
+        f = open('/proc/self/statm', 'r')
+        pages = int(f.read().split()[1])
+        f.close()
+    except (IOError, OSError, ValueError, IndexError):
+        return 0
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+def _sample_rss(p):
+    # keep track of the peak resident set size of the current stage
+    while not p['done'].wait(PROFILE_SAMPLE):
+        p['rss'] = max(p['rss'], _rss())
+
+def enable_profile(table=False, json_file=None, dump=None):
+    # start recording the time and peak memory of each stage, the results are
+    # reported when the process exits
+    global _profile
+    if _profile is None:
+        _profile = {
+            'stages': OrderedDict(),
+            'active': None,
+            'rss': 0,
+            'done': threading.Event(),
+            'table': False,
+            'json': None,
+            'dump': None,
+        }
+        t = threading.Thread(target=_sample_rss, args=(_profile,))
+        t.daemon = True
+        t.start()
+        _profile['sampler'] = t
+        atexit.register(profile_report)
+
+    _profile['table'] = _profile['table'] or table
+    if json_file is not None:
+        _profile['json'] = json_file
+    if dump is not None:
+        _profile['dump'] = dump
+
+def profile_option(o, a):
+    # handle one of the PROFILE_OPTS as returned by getopt
+    if o == '--profile':
+        enable_profile(table=True)
+    elif o == '--profile-json':
+        enable_profile(json_file=a)
+    elif o == '--profile-dump':
+        enable_profile(dump=a)
+
+@contextmanager
+def stage(name):
+    # record time and peak memory of the enclosed block as processing stage
+    # name, repeated stages (e.g. one per directory) are summed up. Stages
+    # nested within another one are accounted to the outer one.
+    p = _profile
+    if p is None or p['active'] is not None:
+        yield
+        return
+
+    rec = p['stages'].get(name)
+    if rec is None:
+        rec = p['stages'][name] = {
+            'calls': 0,
+            'time': 0.0,
+            'rss_peak': 0,
+            'traced_peak': None,
+            'cprofile': cProfile.Profile() if p['dump'] is not None else None,
+        }
+
+    # heap allocations are only traced if python runs with tracemalloc
+    # enabled, e.g. python3 -X tracemalloc, tracing slows down everything
+    tracing = tracemalloc is not None and tracemalloc.is_tracing()
+    if tracing and hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+
+    p['active'] = name
+    p['rss'] = _rss()
+    if rec['cprofile'] is not None:
+        rec['cprofile'].enable()
+    t0 = timeit.default_timer()
+    try:
+        yield
+    finally:
+        rec['time'] += timeit.default_timer() - t0
+        if rec['cprofile'] is not None:
+            rec['cprofile'].disable()
+        rec['calls'] += 1
+        rec['rss_peak'] = max(rec['rss_peak'], p['rss'], _rss())
+        if tracing:
+            rec['traced_peak'] = max(rec['traced_peak'] or 0, tracemalloc.get_traced_memory()[1])
+        p['active'] = None
+
+def profiled(name):
+    # decorator recording every call of the function as stage name
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def profile_breakdown():
+    # per stage number of calls, total time in seconds and peak memory in
+    # bytes, in the order the stages were first entered
+    if _profile is None:
+        return OrderedDict()
+
+    total = sum(rec['time'] for rec in _profile['stages'].values())
+    stages = OrderedDict()
+    for name, rec in _profile['stages'].items():
+        stages[name] = OrderedDict([
+            ('calls', rec['calls']),
+            ('time', rec['time']),
+            ('share', rec['time'] / total if total > 0 else 0.0),
+            ('rss_peak', rec['rss_peak']),
+            ('traced_peak', rec['traced_peak']),
+        ])
+    return stages
+
+def profile_reset():
+    # forget the stages recorded so far, e.g. between benchmark runs
+    if _profile is not None:
+        _profile['stages'].clear()
+
+def profile_report():
+    p = _profile
+    if p is None or p['done'].is_set():
+        return
+    p['done'].set()
+    p['sampler'].join()
+
+    stages = profile_breakdown()
+    if p['table']:
+        sys.stderr.write("{:<12} {:>6} {:>10} {:>6} {:>14} {:>14}\n".format(
+            'stage', 'calls', 'time [s]', '%', 'peak RSS [MB]', 'traced [MB]'))
+        for name, s in stages.items():
+            traced = "{:>14.1f}".format(s['traced_peak'] / 1e6) if s['traced_peak'] is not None else "{:>14}".format('-')
+            sys.stderr.write("{:<12} {:>6} {:>10.4f} {:>6.1f} {:>14.1f} {}\n".format(
+                name, s['calls'], s['time'], 100 * s['share'], s['rss_peak'] / 1e6, traced))
+
+    if p['json'] is not None:
+        f = open(p['json'], 'w')
+        json.dump(OrderedDict([ ('argv', sys.argv), ('stages', stages) ]), f, indent=2)
+        f.write('\n')
+        f.close()
+
+    if p['dump'] is not None and len(stages) > 0:
+        # only the slowest stage is of interest
+        name = max(stages, key=lambda n: stages[n]['time'])
+        p['stages'][name]['cprofile'].dump_stats(p['dump'])
+        sys.stderr.write("profile of stage {} written to {}\n".format(name, p['dump']))
+
+def fit_time_steps(ts, T, tmin=0):
+    # use negative indices as in python and clip to the valid range
+    ts = np.asarray(ts, dtype=np.int64)
+    ts = np.where(ts < 0, T + ts, ts)
+    return np.clip(ts, tmin, T - 1)
+
+def get_rewards(ddir, rfile='reward.log'):
+    rewards = load_csv(os.path.join(ddir, rfile))
+    # the first column is time
+    return rewards[:,0], rewards[:,1:]
+
+def count_rows(fname, blocksize=1 << 20):
+    # count lines without parsing them, a last line without trailing newline
+    # is counted as well
+    a = _archive_member(fname)
+    if a is not None:
+        return _archive_log(a[0], a[1])['rows']
+
+    if _memcache is not None:
+        key = ('rows', os.path.abspath(fname))
+        validator = _file_key(fname)
+        n = _memcache_get(key, validator)
+        if n is None:
+            n = _count_rows(fname, blocksize)
+            _memcache_put(key, validator, n, 0)
+        return n
+
+    return _count_rows(fname, blocksize)
+
+def count_columns(fname, delimiter=','):
+    a = _archive_member(fname)
+    if a is not None:
+        return _archive_log(a[0], a[1])['cols']
+
+    f = open(fname, 'r')
+    line = f.readline()
+    f.close()
+    return line.count(delimiter) + 1
+
+def _count_rows(fname, blocksize):
+    n = 0
+    last = b'\n'
+    f = open(fname, 'rb')
+    while True:
+        buf = f.read(blocksize)
+        if not buf:
+            break
+        n += buf.count(b'\n')
+        last = buf[-1:]
+    f.close()
+
+    if last != b'\n':
+        n += 1
+
+    return n
+
+def _text_chunks(f, chunksize, stop, delimiter, dtype):
+    n = 0
+    while stop is None or n < stop:
+        lines = list(itertools.islice(f, chunksize if stop is None else min(chunksize, stop - n)))
+        if len(lines) == 0:
+            break
+        n += len(lines)
+        yield parse_csv(b''.join(lines), delimiter, dtype)
+
+def read_chunks(fname, chunksize=CHUNK_ROWS, delimiter=',', dtype=np.float64, stop=None):
+    # yield the rows of a log file in blocks of at most chunksize rows, so
+    # only one block needs to be held in memory at a time. Only stop rows
+    # are returned if given and reading ends there, in an archive only the
+    # chunks before are read. With the memory cache the whole log is read
+    # and cached nevertheless, later calls may need more rows.
+    blocks = None
+    if _memcache is not None:
+        key = ('csv', os.path.abspath(fname), delimiter, np.dtype(dtype).name)
+        validator = _file_key(fname)
+        cached = _memcache_get(key, validator)
+        if cached is not None:
+            n = 0
+            for block in cached:
+                if stop is not None and n >= stop:
+                    break
+                yield block if stop is None else block[:stop - n]
+                n += len(block)
+            return
+        # keep the blocks for the cache unless they exceed its budget
+        blocks = []
+        nbytes = 0
+
+    a = _archive_member(fname)
+    end = stop if blocks is None else None
+    f = None
+    if a is not None:
+        # chunks of the archive, split to at most chunksize rows
+        source = (chunk[i:i + chunksize].astype(dtype, copy=False)
+                    for chunk in _archive_chunks(a[0], a[1], stop=end) for i in range(0, len(chunk), chunksize))
+    else:
+        f = open(fname, 'rb')
+        source = _text_chunks(f, chunksize, end, delimiter, dtype)
+    try:
+        n = 0
+        for block in source:
+            if blocks is not None:
+                nbytes += block.nbytes
+                if nbytes <= _memcache['budget']:
+                    # cached blocks are shared between callers
+                    block.flags.writeable = False
+                    blocks.append(block)
+                else:
+                    blocks = None
+            if stop is None or n < stop:
+                yield block if stop is None else block[:stop - n]
+            elif blocks is None:
+                break
+            n += len(block)
+    finally:
+        if f is not None:
+            f.close()
+
+    if blocks is not None:
+        _memcache_put(key, validator, blocks, nbytes)
+
+def _scan_lines(fname, start, blocksize=1 << 20):
+    # byte offsets just past every newline from start on
+    ends = []
+    f = open(fname, 'rb')
+    f.seek(start)
+    pos = start
+    while True:
+        buf = f.read(blocksize)
+        if not buf:
+            break
+        ends.append(np.flatnonzero(np.frombuffer(buf, dtype=np.uint8) == ord('\n')) + pos + 1)
+        pos += len(buf)
+    f.close()
+
+    return np.concatenate(ends) if ends else np.zeros(0, dtype=np.int64)
+
+def _line_index_key(fname, idx):
+    # identifies the data an index was built from: the inode of the log and
+    # checksums of its first and last indexed line
+    key = [ LINE_INDEX_MAGIC, os.stat(fname).st_ino, 0, 0 ]
+    if len(idx) < 2:
+        return key
+    f = open(fname, 'rb')
+    for k, i in ((2, 0), (3, len(idx) - 2)):
+        f.seek(int(idx[i]))
+        key[k] = zlib.crc32(f.read(int(idx[i + 1] - idx[i]))) & 0xffffffff
+    f.close()
+    return key
+
+def _valid_line_index(fname, stored, size):
+    # logs are only ever appended to, so an index stays valid as long as the
+    # lines it covers are still the same. A log rewritten in place, e.g. by
+    # re-running an experiment into the same directory, changes the first
+    # or the last indexed line.
+    idx = stored[LINE_INDEX_HEADER:]
+    if len(idx) == 0 or idx[0] != 0 or idx[-1] > size:
+        return False
+    return list(stored[:LINE_INDEX_HEADER]) == _line_index_key(fname, idx)
+
+def line_index(fname):
+    # returns the byte offsets of the start of every complete line of a log
+    # followed by the end offset of the last one, so line i spans
+    # idx[i]:idx[i + 1]. The index is built in a single pass, stored next to
+    # the log and extended by the lines appended since it was written.
+    if _memcache is not None:
+        key = ('lines', os.path.abspath(fname))
+        validator = _file_key(fname)
+        idx = _memcache_get(key, validator)
+        if idx is not None:
+            return idx
+
+    iname = fname + LINE_INDEX
+    size = os.path.getsize(fname)
+    idx = None
+    if os.path.isfile(iname):
+        try:
+            stored = np.load(iname, mmap_mode='r')
+            if _valid_line_index(fname, stored, size):
+                idx = stored[LINE_INDEX_HEADER:]
+        except (IOError, ValueError):
+            idx = None
+    if idx is None:
+        idx = np.zeros(1, dtype=np.int64)
+
+    if idx[-1] < size:
+        ends = _scan_lines(fname, int(idx[-1]))
+        if len(ends) > 0:
+            idx = np.concatenate((idx, ends))
+            try:
+                f = open(iname + '.tmp', 'wb')
+                np.save(f, np.concatenate((np.array(_line_index_key(fname, idx), dtype=np.int64), idx)))
+                f.close()
+                os.rename(iname + '.tmp', iname)
+            except (IOError, OSError):
+                # the index still works, it's just not kept
+                pass
+
+    if _memcache is not None:
+        _memcache_put(key, validator, idx, idx.nbytes)
+
+    return idx
+
+def read_rows(fname, ts, delimiter=',', dtype=np.float64):
+    # parse only the rows with the given indices (negative ones count from
+    # the end), in the order given. Thanks to the line index every run of
+    # consecutive rows is read with a single seek.
+    a = _archive_member(fname)
+    idx = line_index(fname) if a is None else None
+    T = len(idx) - 1 if a is None else count_rows(fname)
+    ts = np.asarray(ts, dtype=np.int64)
+    ts = np.where(ts < 0, T + ts, ts)
+    if len(ts) > 0 and (ts.min() < 0 or ts.max() >= T):
+        raise ValueError("rows {} requested, but {} has {} rows".format(list(ts), fname, T))
+    if a is not None:
+        return _archive_rows(a[0], a[1], ts, dtype)
+
+    wanted = np.unique(ts)
+    runs = np.split(wanted, np.flatnonzero(np.diff(wanted) != 1) + 1)
+    data = []
+    f = open(fname, 'rb')
+    try:
+        for run in runs:
+            if len(run) == 0:
+                continue
+            f.seek(int(idx[run[0]]))
+            data.append(f.read(int(idx[run[-1] + 1] - idx[run[0]])))
+    finally:
+        f.close()
+
+    rows = parse_csv(b''.join(data), delimiter, dtype)
+    return rows[np.searchsorted(wanted, ts)] if len(ts) > 0 else rows
+
+def tail_log(fname, delimiter=',', dtype=np.float64):
+    # follow a log which is still being appended to: every next() returns the
+    # complete lines appended since the previous call (possibly none). The
+    # byte offset of the first incomplete line is remembered, so only new
+    # data is read and parsed. Logs in an archive are complete, they are
+    # returned at once.
+    if _archive_member(fname) is not None:
+        yield load_csv(fname, delimiter, dtype)
+        while True:
+            yield np.zeros((0, 0), dtype=dtype)
+
+    offset = 0
+    while True:
+        rows = np.zeros((0, 0), dtype=dtype)
+        if os.path.isfile(fname):
+            f = open(fname, 'rb')
+            f.seek(offset)
+            buf = f.read()
+            f.close()
+
+            end = buf.rfind(b'\n') + 1
+            if end > 0:
+                rows = parse_csv(buf[:end], delimiter, dtype)
+                offset += end
+
+        yield rows
+
+def append_rows(buf, n, rows):
+    # append rows after the first n rows of buf, which is grown geometrically
+    # so appending costs amortized time proportional to the new rows only.
+    # Returns the (possibly reallocated) buffer and the new number of rows.
+    if buf is None:
+        buf = np.zeros((max(len(rows), 1024),) + rows.shape[1:], dtype=rows.dtype)
+    if n + len(rows) > len(buf):
+        grown = np.zeros((max(2 * len(buf), n + len(rows)),) + buf.shape[1:], dtype=buf.dtype)
+        grown[:n] = buf[:n]
+        buf = grown
+    buf[n:n + len(rows)] = rows
+
+    return buf, n + len(rows)
+
+def refresh(fig, interval, pdf=None):
+    # drive a live plot: yields every interval seconds so the caller can
+    # update fig, which is then redrawn. If pdf is given the figure is
+    # written there instead of being shown, but only if the caller changed
+    # it (matplotlib marks changed figures stale). The file is replaced at
+    # once so readers never see a partially written one. Stops when the
+    # figure window is closed or on keyboard interrupt.
+    import matplotlib.pyplot as plt
+    fig.stale = False
+    try:
+        while True:
+            yield
+            if pdf is not None:
+                if fig.stale:
+                    fig.savefig(pdf + '.tmp', format=os.path.splitext(pdf)[1][1:], dpi=300,
+                            bbox_inches='tight', pad_inches=0.15)
+                    os.rename(pdf + '.tmp', pdf)
+                    fig.stale = False
+                time.sleep(interval)
+            elif plt.fignum_exists(fig.number):
+                fig.canvas.draw_idle()
+                plt.pause(interval)
+            else:
+                return
+    except KeyboardInterrupt:
+        return
+
+def cumulative_reward(rewards, ts=None, T=None):
+    # rewards is either a (T, N) array or an iterable of row blocks of it,
+    # in which case the total number of rows T needs to be given as well
+    if isinstance(rewards, np.ndarray):
+        T = rewards.shape[0]
+        rewards = [rewards]
+
+    # only return the time steps in the range N,M if given
+    if ts is not None and len(ts) == 2:
+        a, b = fit_time_steps(ts, T)
+    else:
+        a, b = 0, T - 1
+
+    # fold the blocks into running sums, r[t] holds the reward accumulated
+    # before time step t
+    r = None
+    start = 0
+    for block in rewards:
+        n, N = block.shape
+        if r is None:
+            r = np.zeros((max(b - a + 1, 0), N))
+            total = np.zeros(N)
+
+        p = np.cumsum(block, axis=0)
+        p += total - block
+        lo, hi = max(a, start), min(b + 1, start + n)
+        if lo < hi:
+            r[lo - a:hi - a] = p[lo - start:hi - start]
+
+        total += block.sum(axis=0)
+        start += n
+
+    return np.arange(a, b + 1), r
+
+def _log_changes(fname, T, chunksize):
+    # time column and norms of the change of a single weight log's row from
+    # one time step to the next. The log is read block by block, the last
+    # row of a block is carried over to the next one.
+    time = np.zeros(T)
+    changes = np.zeros(max(T - 1, 0))
+    last = None
+    n = 0
+    for block in read_chunks(fname, chunksize, stop=T):
+        time[n:n + len(block)] = block[:,0]
+        w = block[:,1:] if last is None else np.vstack((last, block[:,1:]))
+        d = np.diff(w, axis=0)
+        a = max(n - 1, 0)
+        changes[a:a + len(d)] = np.sqrt(np.einsum('to,to->t', d, d))
+        last = block[-1:,1:]
+        n += len(block)
+    if n != T:
+        raise ValueError("inconsistent size of weight file {}".format(fname))
+
+    return time, changes
+
+def weight_changes(ddir, axis, chunksize=CHUNK_ROWS):
+    # norms of the weight change from one time step to the next, per input
+    # (over all outputs) and overall: element t is ||W[t+1] - W[t]||. Each
+    # weight log is streamed on its own, so only the norms are held in
+    # memory. Returns the time steps, the per-input and the overall norms.
+    T = weight_steps(ddir)
+    files = _weight_files(ddir, axis)
+    pattern = re.compile('weights_{}_in_(\d+).*\.log'.format(axis))
+    time = None
+    per_input = np.zeros((max(T - 1, 0), len(files)))
+    for fname in files:
+        n = int(pattern.match(fname).group(1))
+        time, per_input[:,n] = _log_changes(os.path.join(ddir, fname), T, chunksize)
+
+    return time, per_input, np.sqrt((per_input ** 2).sum(axis=1))
+
+def convergence_step(changes, eps):
+    # first time step after which the changes (as returned by weight_changes)
+    # stay below eps, -1 if they never do. For 2-D changes the step is
+    # determined for each column.
+    above = np.asarray(changes) >= eps
+    n = above.shape[0]
+    if n == 0:
+        return 0 if above.ndim == 1 else np.zeros(above.shape[1], dtype=np.int64)
+
+    last = n - np.argmax(above[::-1], axis=0)
+    last = np.where(above.any(axis=0), last, 0)
+    step = np.where(last < n, last, -1)
+
+    return int(step) if step.ndim == 0 else step
+
+def weight_convergence(ddir, axis, eps, chunksize=CHUNK_ROWS):
+    return convergence_step(weight_changes(ddir, axis, chunksize)[2], eps)